@@ -1,14 +1,29 @@
 import asyncio
 from typing import Any, Callable, Coroutine, NoReturn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from starlette.websockets import WebSocketState
 from utils.middleware import RealIPMiddleware, inject as inject_client
 from contextlib import asynccontextmanager
 from candle import CandleManager
+from candle.manager import BROADCAST_PERIOD, dumps
 from utils.logger import logger, APP_TITLE
+from utils import metrics, upstream
+from utils.profiler import profiler
+from utils.wheel import TimingWheel
+import hashlib
+import secrets
 import time
 import sys
+import os
+
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+REST_OPEN_MAX_AGE = int(os.getenv('REST_OPEN_MAX_AGE', 5))
+REST_CLOSED_MAX_AGE = int(os.getenv('REST_CLOSED_MAX_AGE', 31536000))
+HEARTBEAT_TIMEOUT = float(os.getenv('HEARTBEAT_TIMEOUT', 60))
+HEARTBEAT_BATCH = int(os.getenv('HEARTBEAT_BATCH', 200))
 
 
 
@@ -62,15 +77,19 @@ def on_shutdown(func: Callable[[], Coroutine[Any, Any, None] | Coroutine[Any, An
 class WebSocketManager:
     def __init__(self):
         self._clients: dict[WebSocket, dict[str, Any]] = {}
+        self._deadlines: TimingWheel[WebSocket] = TimingWheel(HEARTBEAT_TIMEOUT)
 
     async def connect(self, ws: WebSocket):
         await ws.accept()
+        now = time.time()
         self._clients[ws] = {
-            'ts': time.time(),
+            'ts': now,
             'manager': CandleManager,
         }
+        self._deadlines.touch(ws, now + HEARTBEAT_TIMEOUT)
 
     async def disconnect(self, ws: WebSocket, code: int = 1000, reason: str = 'Connection Closed'):
+        self._deadlines.discard(ws)
         try:
             await ws.close(code, reason)
             ws_block: dict[str, Any] = self._clients.pop(ws)
@@ -87,34 +106,31 @@ class WebSocketManager:
         if message['type'] == 'ping':
             await ws.send_json({'type': 'pong'})
             ws_block['ts'] = time.time()
+            self._deadlines.touch(ws, ws_block['ts'] + HEARTBEAT_TIMEOUT)
         elif ws_block['manager'] and hasattr(ws_block['manager'], 'message_handle'):
             await ws_block['manager'].message_handle(ws, message)
 
+    async def _expire(self, ws: WebSocket):
+        try:
+            if ws.client_state == WebSocketState.CONNECTED:
+                await self.disconnect(ws, 1006, 'Heartbeat Timeout')
+        except WebSocketDisconnect: pass
+        except Exception as e:
+            logger.error(f"Error while closing WebSocket: {e}")
+
     async def heartbeat(self):
         while True:
-            for ws, ws_block in self._clients.copy().items():
-                if ws_block['ts'] + 60 < time.time():
-                    try:
-                        if ws.client_state == WebSocketState.CONNECTED:
-                            await self.disconnect(ws, 1006, 'Heartbeat Timeout')
-                    except WebSocketDisconnect: pass
-                    except Exception as e:
-                        logger.error(f"Error while closing WebSocket: {e}")
-            await asyncio.sleep(30)
+            expired = self._deadlines.expire(time.time())
+            for i in range(0, len(expired), HEARTBEAT_BATCH):
+                await asyncio.gather(*[self._expire(ws) for ws in expired[i:i + HEARTBEAT_BATCH]])
+            await asyncio.sleep(1)
 
     async def broadcast(self):
-        while True:
-            ts = time.time()
-            try:
-                await CandleManager.broadcast()
-            except Exception as e:
-                logger.exception(f"Error while broadcasting: {e}")
-            now = time.time()
-            if now - ts < 60:
-                await asyncio.sleep(60 - now % 60)
+        await CandleManager.run()
 
 
 manager = WebSocketManager()
+metrics.CONNECTED_SOCKETS.set_function(lambda: len(manager._clients))
 
 @on_startup
 async def start_heartbeat():
@@ -125,6 +141,97 @@ async def start_heartbeat():
 @on_shutdown
 async def stop_all_connections():
     await manager.disconnect_all()
+    await upstream.aclose()
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics_endpoint():
+    if not metrics.ENABLED:
+        return PlainTextResponse('Metrics disabled', status_code=404)
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+
+def cacheable(request: Request, body: dict[str, Any], closed: bool) -> Response:
+    """
+    Respond with a strong ETag; ranges of closed candles never change and may be cached for good,
+    while anything containing the open candle lives until the next broadcast at most.
+    """
+    payload = dumps(body)
+    etag = '"' + hashlib.sha1(payload.encode()).hexdigest() + '"'
+    if closed:
+        cache_control = f'public, max-age={REST_CLOSED_MAX_AGE}, immutable'
+    else:
+        max_age = max(0, min(REST_OPEN_MAX_AGE, int(BROADCAST_PERIOD - time.time() % BROADCAST_PERIOD)))
+        cache_control = f'public, max-age={max_age}'
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(payload, media_type='application/json', headers=headers)
+
+
+def rest_error(e: Exception) -> JSONResponse:
+    return JSONResponse(
+        {'status': 'error', 'message': str(e), 'data': []},
+        status_code=404 if isinstance(e, LookupError) else 400,
+        headers={'Cache-Control': 'no-store'},
+    )
+
+
+@app.get('/candles')
+async def candles_latest(request: Request):
+    """
+    The latest candles of a tag, given as `tag` or as the fields of a `listen` message.
+    """
+    try:
+        tag = CandleManager.get_tag(dict(request.query_params))
+        csr = await CandleManager.reader(tag)
+        latest = await csr.latest()
+    except (ValueError, LookupError) as e:
+        return rest_error(e)
+    body = {'status': 'success', 'tag': csr.tag, 'data': [candle.model_dump() for candle in latest]}
+    if hasattr(csr.factory, 'info'):
+        body['info'] = csr.factory.info
+    return cacheable(request, body, closed=False)
+
+
+@app.get('/candles/history')
+async def candles_history(request: Request, start: int, limit: int | None = None):
+    """
+    Historical candles of a tag, same semantics as the `history` message.
+    """
+    try:
+        tag = CandleManager.get_tag(dict(request.query_params))
+        csr = await CandleManager.reader(tag)
+        history = await csr.history(start, limit)
+    except (ValueError, LookupError) as e:
+        return rest_error(e)
+    body = {'status': 'success', 'tag': csr.tag, 'data': [candle.model_dump() for candle in history]}
+    return cacheable(request, body, closed=bool(history) and csr.settled(start, limit))
+
+
+def admin_allowed(token: str) -> bool:
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+@app.get('/admin/profile')
+async def profile_status(x_admin_token: str = Header('')):
+    if not admin_allowed(x_admin_token):
+        return JSONResponse({'status': 'error', 'message': 'Forbidden'}, status_code=403)
+    return {'status': 'success', **profiler.status()}
+
+
+@app.post('/admin/profile')
+async def profile_start(cycles: int = 1, x_admin_token: str = Header('')):
+    """
+    Run the sampling profiler for the next `cycles` broadcast cycles, the result is dumped into PROFILE_DIR.
+    """
+    if not admin_allowed(x_admin_token):
+        return JSONResponse({'status': 'error', 'message': 'Forbidden'}, status_code=403)
+    try:
+        profiler.start(cycles)
+    except (ValueError, RuntimeError) as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=409)
+    return {'status': 'success', **profiler.status()}
 
 
 @app.websocket('/ws')
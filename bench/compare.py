@@ -0,0 +1,49 @@
+"""
+Compare two benchmark JSON results (from `bench.load` or `bench.micro`) leaf by leaf.
+
+    python -m bench.compare base.json head.json --threshold 0.1
+
+Exits with status 1 when a latency/duration-like value got worse by more than the threshold.
+"""
+from typing import Any, Iterator
+import argparse
+import json
+import sys
+
+
+# Keys where bigger is worse.
+WORSE_IF_HIGHER = ('latency', 'cycle', 'cpu', 'rss', 'errors', 'mean', 'median', 'p50', 'p90', 'p99', 'max', 'stdev')
+SKIP = ('config', 'commit', 'timestamp', 'elapsed', 'count', 'python', 'rounds')
+
+
+def leaves(data: Any, prefix: str = '') -> Iterator[tuple[str, float]]:
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in SKIP: continue
+            yield from leaves(value, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+    with open(args.base, encoding='utf-8') as f:
+        base = dict(leaves(json.load(f)))
+    with open(args.head, encoding='utf-8') as f:
+        head = dict(leaves(json.load(f)))
+    regressions = 0
+    for key in sorted(base.keys() & head.keys()):
+        old, new = base[key], head[key]
+        change = (new - old) / old if old else 0.0
+        worse = any(part in key for part in WORSE_IF_HIGHER) and change > args.threshold
+        regressions += worse
+        print(f'{"!" if worse else " "} {key:<60} {old:>14.6g} -> {new:>14.6g} ({change:+.1%})')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
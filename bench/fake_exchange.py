@@ -0,0 +1,165 @@
+"""
+Local stand-in for the upstream kline APIs.
+
+Every exchange in `candle.cex` and GeckoTerminal is served under `/<original host>/<original path>`,
+which is where `UPSTREAM_OVERRIDE` sends the service's requests. Rows are laid out from each
+exchange's `KLINE_MAPPER` / `KLINE_PATH` / `TS_UNIT`, so the adapters parse them like the real thing.
+
+    python -m bench.fake_exchange --port 9100 --latency 0.05 --jitter 0.02 --error-rate 0.01
+"""
+from typing import Any
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from candle import cex
+import argparse
+import asyncio
+import inspect
+import random
+import math
+import time
+import zlib
+import os
+
+
+LATENCY = float(os.getenv('FAKE_LATENCY', 0.05))
+JITTER = float(os.getenv('FAKE_JITTER', 0.02))
+ERROR_RATE = float(os.getenv('FAKE_ERROR_RATE', 0.0))
+RATE_LIMIT_RATE = float(os.getenv('FAKE_RATE_LIMIT_RATE', 0.0))
+GECKO_HOST = 'api.geckoterminal.com'
+
+EXCHANGES: dict[str, type[cex.CexExchange]] = {
+    obj.NETLOC: obj
+    for _, obj in inspect.getmembers(cex, inspect.isclass)
+    if issubclass(obj, cex.CexExchange) and obj != cex.CexExchange
+}
+# Real APIs that answer newest-first; the adapters are expected to reverse them.
+DESCENDING = {'okx', 'kucoin'}
+
+app = FastAPI(title='fake-exchange')
+stats = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+
+
+def price(symbol: str, ts: int) -> float:
+    seed = zlib.crc32(symbol.encode()) % 1000
+    return 100 + seed / 10 + 5 * math.sin(ts / 3600 + seed)
+
+
+def ohlcv(symbol: str, ts: int, interval: int) -> tuple[float, float, float, float, float]:
+    o, c = price(symbol, ts), price(symbol, ts + interval)
+    wiggle = abs(o - c) + 0.01
+    volume = 1 + (zlib.crc32(f'{symbol}{ts}'.encode()) % 10000) / 100
+    return o, max(o, c) + wiggle, min(o, c) - wiggle, c, volume
+
+
+def window(start: int | None, end: int | None, limit: int, interval: int) -> list[int]:
+    now = int(time.time()) // interval * interval
+    if start is not None:
+        first = start // interval * interval
+        last = min(now, first + (limit - 1) * interval)
+    else:
+        last = min(now, (end // interval * interval - interval) if end is not None else now)
+        first = last - (limit - 1) * interval
+    return list(range(first, last + 1, interval))
+
+
+def seconds(value: str | None) -> int | None:
+    if not value: return None
+    ts = int(value)
+    return ts // 1000 if ts > 0xFFFFFFFF else ts
+
+
+async def simulate() -> JSONResponse | None:
+    stats['requests'] += 1
+    await asyncio.sleep(max(0.0, random.gauss(LATENCY, JITTER)))
+    roll = random.random()
+    if roll < RATE_LIMIT_RATE:
+        stats['rate_limited'] += 1
+        return JSONResponse({'error': 'rate limited'}, status_code=429, headers={'Retry-After': '1'})
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        stats['errors'] += 1
+        return JSONResponse({'error': 'internal error'}, status_code=500)
+    return None
+
+
+def layout(exchange: type[cex.CexExchange], rows: list[tuple[int, float, float, float, float, float]]) -> Any:
+    """
+    Lay (ts seconds, open, high, low, close, volume) rows out the way the exchange's API returns them.
+    """
+    width = max(path for path in exchange.KLINE_MAPPER.values() if isinstance(path, int)) + 1
+    result = []
+    for ts, o, h, l, c, v in rows:
+        row: list[Any] = ['0'] * width
+        values = {'_ts': ts * 1000 if exchange.TS_UNIT else ts, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v, 'turnover': v * c}
+        for name, path in exchange.KLINE_MAPPER.items():
+            if path is None: continue
+            row[path] = values[name] if name == '_ts' else f'{values[name]:.8f}'
+        result.append(row)
+    if exchange.ID in DESCENDING:
+        result.reverse()
+    for key in reversed(list(filter(None, exchange.KLINE_PATH.split('->')))):
+        result = {key: result}
+    return result
+
+
+def gecko_layout(pool: str, rows: list[tuple[int, float, float, float, float, float]]) -> Any:
+    return {
+        'data': {'id': pool, 'type': 'ohlcv_request_response', 'attributes': {'ohlcv_list': [list(row) for row in reversed(rows)]}},
+        'meta': {
+            'base': {'address': pool, 'name': 'Fake Token', 'symbol': 'FAKE'},
+            'quote': {'address': '0x0', 'name': 'Wrapped Ether', 'symbol': 'WETH'},
+        },
+    }
+
+
+def cex_klines(exchange: type[cex.CexExchange], params: dict[str, str]) -> Any:
+    interval_name = next(
+        (name for name, value in exchange.KLINE_INTERVAL_MAPPER.items() if value == params.get(exchange.KLINE_QUERY_INTERVAL_PARAM)),
+        '1m',
+    )
+    interval = exchange.KLINE_INTERVAL_TIME_MAPPER[interval_name]
+    limit = min(int(params.get(exchange.KLINE_QUERY_LIMIT_PARAM) or 500), 1000)
+    start = seconds(params.get(exchange.KLINE_QUERY_START_PARAM)) if exchange.KLINE_QUERY_START_PARAM else None
+    end = seconds(params.get(exchange.KLINE_QUERY_END_PARAM)) if exchange.KLINE_QUERY_END_PARAM else None
+    symbol = params.get(exchange.KLINE_QUERY_SYMBOL_PARAM, '')
+    return layout(exchange, [(ts, *ohlcv(symbol, ts, interval)) for ts in window(start, end, limit, interval)])
+
+
+def gecko_klines(path: str, params: dict[str, str]) -> Any:
+    # /api/v2/networks/{network}/pools/{pool}/ohlcv/{timeframe}
+    parts = path.split('/')
+    pool, timeframe = parts[-3], parts[-1]
+    interval = int(params.get('aggregate', 1)) * {'minute': 60, 'hour': 3600, 'day': 86400}.get(timeframe, 60)
+    limit = min(int(params.get('limit') or 100), 1000)
+    return gecko_layout(pool, [(ts, *ohlcv(pool, ts, interval)) for ts in window(None, seconds(params.get('before_timestamp')), limit, interval)])
+
+
+@app.get('/stats')
+async def get_stats():
+    return stats
+
+
+@app.get('/{host}/{path:path}')
+async def serve(host: str, path: str, request: Request):
+    failure = await simulate()
+    if failure is not None:
+        return failure
+    params = dict(request.query_params)
+    if host == GECKO_HOST:
+        return gecko_klines(path, params)
+    if host in EXCHANGES:
+        return cex_klines(EXCHANGES[host], params)
+    return JSONResponse({'error': f'unknown upstream {host}'}, status_code=404)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=LATENCY, help='mean response latency in seconds')
+    parser.add_argument('--jitter', type=float, default=JITTER, help='standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=ERROR_RATE, help='fraction of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=RATE_LIMIT_RATE, help='fraction of requests answered with 429')
+    args = parser.parse_args()
+    LATENCY, JITTER, ERROR_RATE, RATE_LIMIT_RATE = args.latency, args.jitter, args.error_rate, args.rate_limit_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
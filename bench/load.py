@@ -0,0 +1,276 @@
+"""
+End-to-end load benchmark.
+
+Starts the fake upstream (`bench.fake_exchange`) and the service (`app:app`) pointed at it through
+`UPSTREAM_OVERRIDE`, then drives simulated WebSocket clients subscribing across many tags and prints
+one JSON document:
+
+    python -m bench.load --clients 2000 --tags 200 --tags-per-client 3 --duration 60 --output load.json
+
+Update latency is measured from the candle boundary (the start of the broadcast period the update
+was received in) to the moment the client got it, so it is only meaningful while cycles finish within
+`--period`. Cycle duration comes from the service's own `/metrics`.
+"""
+from typing import Any
+import subprocess
+import statistics
+import argparse
+import resource
+import asyncio
+import random
+import socket
+import json
+import time
+import sys
+import os
+
+import httpx
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CEX_EXCHANGES = ('binance', 'okx', 'kucoin', 'bitget', 'mexc', 'gate.io')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def summary(values: list[float]) -> dict[str, float | int]:
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': pct(0.50),
+        'p90': pct(0.90),
+        'p99': pct(0.99),
+        'max': ordered[-1],
+    }
+
+
+def make_tags(count: int, dex_ratio: float) -> list[str]:
+    tags = []
+    for i in range(count):
+        if random.random() < dex_ratio:
+            tags.append(f'dex:eth:0x{i:040x}:0x{i + 1:040x}:1m')
+        else:
+            tags.append(f'cex:{CEX_EXCHANGES[i % len(CEX_EXCHANGES)]}:T{i}-USDT:1m')
+    return tags
+
+
+class ProcessSampler:
+    """
+    Samples CPU time and RSS of a process from /proc (Linux only).
+    """
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.rss: list[float] = []
+        self.cpu: list[float] = []
+        self._last: tuple[float, float] | None = None
+
+    def _cpu_seconds(self) -> float:
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+    def _rss_mb(self) -> float:
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def sample(self) -> None:
+        try:
+            now, cpu = time.monotonic(), self._cpu_seconds()
+            self.rss.append(self._rss_mb())
+        except (OSError, IndexError, ValueError):
+            return
+        if self._last is not None:
+            self.cpu.append(100 * (cpu - self._last[1]) / max(now - self._last[0], 1e-9))
+        self._last = (now, cpu)
+
+    async def run(self, every: float = 1.0) -> None:
+        while True:
+            self.sample()
+            await asyncio.sleep(every)
+
+
+class Client:
+    def __init__(self, url: str, tags: list[str], period: int, results: dict[str, Any]) -> None:
+        self.url = url
+        self.tags = tags
+        self.period = period
+        self.results = results
+
+    async def run(self, stop: asyncio.Event) -> None:
+        import websockets
+        try:
+            async with websockets.connect(self.url, max_size=None, open_timeout=60) as ws:
+                await ws.recv()  # Connected notice
+                for tag in self.tags:
+                    sent = time.time()
+                    await ws.send(json.dumps({'type': 'listen', 'data': {'tag': tag}}))
+                    while True:
+                        message = json.loads(await ws.recv())
+                        if message.get('type') in ('init', 'error'):
+                            break
+                    if message.get('status') == 'success':
+                        self.results['subscribe'].append(time.time() - sent)
+                    else:
+                        self.results['subscribe_errors'] += 1
+                next_ping = time.time() + 20
+                while not stop.is_set():
+                    try:
+                        raw = await asyncio.wait_for(ws.recv(), timeout=1)
+                    except asyncio.TimeoutError:
+                        raw = None
+                    now = time.time()
+                    if raw is not None:
+                        message = json.loads(raw)
+                        if message.get('type') == 'update':
+                            self.results['update'].append(now - now // self.period * self.period)
+                            self.results['bytes'] += len(raw)
+                    if now >= next_ping:
+                        await ws.send(json.dumps({'type': 'ping'}))
+                        next_ping = now + 20
+        except Exception as e:
+            self.results['client_errors'] += 1
+            self.results['last_error'] = repr(e)
+
+
+def scrape_cycles(base: str) -> dict[str, float]:
+    try:
+        text = httpx.get(f'{base}/metrics', timeout=10).text
+    except httpx.HTTPError:
+        return {}
+    values = {}
+    for line in text.splitlines():
+        for name in ('candle_broadcast_cycle_seconds_sum', 'candle_broadcast_cycle_seconds_count'):
+            if line.startswith(name + ' '):
+                values[name] = float(line.split()[1])
+    count = values.get('candle_broadcast_cycle_seconds_count', 0)
+    return {'count': count, 'mean': values.get('candle_broadcast_cycle_seconds_sum', 0) / count if count else 0.0}
+
+
+def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+async def drive(args: argparse.Namespace, service: str, sampler: ProcessSampler) -> dict[str, Any]:
+    tags = make_tags(args.tags, args.dex_ratio)
+    results: dict[str, Any] = {'subscribe': [], 'update': [], 'bytes': 0, 'subscribe_errors': 0, 'client_errors': 0}
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler.run())
+    clients = [
+        Client(f'ws://{service}/ws', random.sample(tags, min(args.tags_per_client, len(tags))), args.period, results)
+        for _ in range(args.clients)
+    ]
+    tasks = []
+    for i, client in enumerate(clients):
+        tasks.append(asyncio.create_task(client.run(stop)))
+        if args.ramp and i % 100 == 99:
+            await asyncio.sleep(args.ramp)
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    sampling.cancel()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=100)
+    parser.add_argument('--tags-per-client', type=int, default=3)
+    parser.add_argument('--dex-ratio', type=float, default=0.3, help='fraction of dex: tags')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to keep clients subscribed')
+    parser.add_argument('--period', type=int, default=10, help='BROADCAST_PERIOD of the service')
+    parser.add_argument('--ramp', type=float, default=0.05, help='pause after every 100 connects')
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream mean latency')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    fake_port, service_port = free_port(), free_port()
+    env = dict(os.environ)
+    env.update({
+        'FAKE_LATENCY': str(args.latency),
+        'FAKE_JITTER': str(args.jitter),
+        'FAKE_ERROR_RATE': str(args.error_rate),
+        'FAKE_RATE_LIMIT_RATE': str(args.rate_limit_rate),
+        'UPSTREAM_OVERRIDE': f'http://127.0.0.1:{fake_port}',
+        'BROADCAST_PERIOD': str(args.period),
+        'METRICS_ENABLED': '1',
+    })
+    uvicorn = [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--log-level', 'warning']
+    fake = subprocess.Popen(uvicorn + ['--port', str(fake_port), 'bench.fake_exchange:app'], cwd=ROOT, env=env)
+    service = subprocess.Popen(uvicorn + ['--port', str(service_port), '--ws', 'websockets', 'app:app'], cwd=ROOT, env=env)
+    try:
+        wait_ready(f'http://127.0.0.1:{fake_port}/stats')
+        wait_ready(f'http://127.0.0.1:{service_port}/metrics')
+        sampler = ProcessSampler(service.pid)
+        started = time.time()
+        results = asyncio.run(drive(args, f'127.0.0.1:{service_port}', sampler))
+        elapsed = time.time() - started
+        report = {
+            'benchmark': 'load',
+            'commit': git_commit(),
+            'timestamp': started,
+            'config': vars(args),
+            'elapsed': elapsed,
+            'subscribe_latency': summary(results['subscribe']),
+            'update_latency': summary(results['update']),
+            'updates_received': len(results['update']),
+            'update_bytes': results['bytes'],
+            'subscribe_errors': results['subscribe_errors'],
+            'client_errors': results['client_errors'],
+            'last_client_error': results.get('last_error'),
+            'cycle': scrape_cycles(f'http://127.0.0.1:{service_port}'),
+            'cpu_percent': summary(sampler.cpu),
+            'rss_mb': summary(sampler.rss),
+            'upstream': httpx.get(f'http://127.0.0.1:{fake_port}/stats', timeout=10).json(),
+        }
+    finally:
+        for process in (service, fake):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
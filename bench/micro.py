@@ -0,0 +1,136 @@
+"""
+Microbenchmarks of the per-candle hot paths.
+
+Runs every case at page sizes 3, 500 and 1000 against the stored fixture in `bench/fixtures`
+(laid out per exchange with `bench.fake_exchange.layout`) and prints JSON with per-call and
+per-row timings:
+
+    python -m bench.micro --repeat 15 --output micro.json
+    python -m bench.micro --filter kline_map
+
+`--write-fixture` regenerates the fixture (a seeded random walk); it is only needed when the
+fixture format changes, since committed numbers are only comparable on the same data.
+"""
+from typing import Any, Callable
+from bench.fake_exchange import EXCHANGES, layout, gecko_layout
+from bench.load import git_commit
+from candle import datastruct as ds, dex, manager
+from candle.manager import CandleManager
+import statistics
+import argparse
+import platform
+import pydantic
+import random
+import timeit
+import json
+import os
+import gc
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ohlcv-1000.json')
+SIZES = (3, 500, 1000)
+TAG_MESSAGES = {
+    'tag': {'tag': 'cex:binance:BTC-USDT:1m'},
+    'cex_fields': {'exchange': 'binance', 'symbol': 'BTC-USDT', 'interval': '1m'},
+    'dex_fields': {'chain': 'eth', 'address': '0x' + 'a' * 40, 'pool': '0x' + 'b' * 40, 'interval': '1m'},
+}
+
+
+def write_fixture(rows: int = 1000) -> None:
+    rng = random.Random(42)
+    ts, price = 1_700_000_000 // 60 * 60, 37_000.0
+    data = []
+    for _ in range(rows):
+        o = price
+        c = o * (1 + rng.gauss(0, 0.0008))
+        h = max(o, c) * (1 + abs(rng.gauss(0, 0.0003)))
+        l = min(o, c) * (1 - abs(rng.gauss(0, 0.0003)))
+        data.append([ts, round(o, 2), round(h, 2), round(l, 2), round(c, 2), round(rng.lognormvariate(2, 1), 5)])
+        ts, price = ts + 60, c
+    os.makedirs(os.path.dirname(FIXTURE), exist_ok=True)
+    with open(FIXTURE, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+
+def load_fixture() -> list[tuple[int, float, float, float, float, float]]:
+    with open(FIXTURE, encoding='utf-8') as f:
+        return [tuple(row) for row in json.load(f)]
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> dict[str, float | int]:
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    gc.collect()
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'number': number,
+        'rounds': repeat,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.fmean(runs),
+        'stdev': statistics.stdev(runs) if len(runs) > 1 else 0.0,
+    }
+
+
+def cases(rows: list[tuple[int, float, float, float, float, float]]) -> dict[str, Callable[[], Any]]:
+    result: dict[str, Callable[[], Any]] = {}
+    for size in SIZES:
+        page = rows[-size:]
+        for exchange in sorted(EXCHANGES.values(), key=lambda x: x.ORDER):
+            body = layout(exchange, page)
+            klines = body
+            for key in filter(None, exchange.KLINE_PATH.split('->')): klines = klines[key]
+            result[f'kline_map/{exchange.ID}/{size}'] = lambda exchange=exchange, klines=klines: [exchange.kline_map(kline) for kline in klines]
+        mapped = [EXCHANGES['api.binance.com'].kline_map(kline) for kline in layout(EXCHANGES['api.binance.com'], page)]
+        result[f'candle_construct/{size}'] = lambda mapped=mapped: [ds.Candle(**kline) for kline in mapped]
+        candles = [ds.Candle(**kline) for kline in mapped]
+        result[f'model_dump/{size}'] = lambda candles=candles: [candle.model_dump() for candle in candles]
+        dumped = [candle.model_dump() for candle in candles]
+        result[f'update_encode/{size}'] = lambda dumped=dumped: manager.dumps({'type': 'update', 'data': dumped})
+        result[f'update_dump_encode/{size}'] = lambda candles=candles: manager.dumps({'type': 'update', 'data': [candle.model_dump() for candle in candles]})
+        ohlcv_list = gecko_layout('pool', page)['data']['attributes']['ohlcv_list']
+        result[f'dex_rows/{size}'] = lambda ohlcv_list=ohlcv_list: dex.DexViewer.candles(ohlcv_list)
+    for name, message in TAG_MESSAGES.items():
+        result[f'get_tag/{name}'] = lambda message=message: CandleManager.get_tag(message)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=15, help='timed rounds per case')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per round')
+    parser.add_argument('--filter', default='', help='only run cases containing this substring')
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    parser.add_argument('--write-fixture', action='store_true', help='regenerate the stored fixture and exit')
+    args = parser.parse_args()
+    if args.write_fixture:
+        return write_fixture()
+
+    results = {}
+    for name, func in cases(load_fixture()).items():
+        if args.filter not in name: continue
+        stats = measure(func, args.repeat, args.min_time)
+        size = name.rsplit('/', 1)[-1]
+        if size.isdigit():
+            stats['per_row'] = stats['median'] / int(size)
+        results[name] = stats
+    report = {
+        'benchmark': 'micro',
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pydantic': pydantic.VERSION,
+        'unit': 'seconds',
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
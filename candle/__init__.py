@@ -1,4 +1,7 @@
 from .manager import CandleManager
-from . import cex_impl, dex
+from . import cex_impl, dex, remote, stream
 cex_impl.init()
 dex.init()
+stream.init()
+if remote.ROLE == 'web':
+    remote.init()
@@ -1,5 +1,9 @@
 from typing import Any
+from . import datastruct as ds, health
+from utils import metrics, tracing, upstream
+import asyncio
 import httpx
+import time
 
 
 class CexExchange:
@@ -34,6 +38,7 @@ class CexExchange:
     KLINE_QUERY_START_PARAM = ''
     KLINE_QUERY_END_PARAM = ''
     KLINE_QUERY_LIMIT_PARAM = ''
+    KLINE_MAX_LIMIT = 100 # most klines one request returns
     KLINE_QUERY_INTERVAL_PARAM = ''
     KLINE_INTERVAL_MAPPER = {
         '1m': '1m',
@@ -58,6 +63,7 @@ class CexExchange:
         None: 60
     }
     TS_UNIT = 0 # 0 (seconds), 1 (milliseconds)
+    RATE_LIMIT = 10.0 # kline requests per second we allow ourselves
     
     @classmethod
     def symbol_filter(cls, symbol: dict[str, Any]):
@@ -111,6 +117,7 @@ class CexExchange:
             for name, path in cls.KLINE_MAPPER.items()
         }
 
+    @tracing.traced('cex.fetch')
     async def fetch(self, base: str, quote: str, start: int | None = None, limit: int | None = None, interval: str | None = None):
         query_params = self.KLINE_QUERY.copy()
         query_params[self.KLINE_QUERY_SYMBOL_PARAM] = self.symbol_name(base, quote)
@@ -125,34 +132,64 @@ class CexExchange:
         
         if interval and self.KLINE_QUERY_INTERVAL_PARAM and self.KLINE_INTERVAL_MAPPER.get(interval):
             query_params[self.KLINE_QUERY_INTERVAL_PARAM] = self.KLINE_INTERVAL_MAPPER[interval]
+        started = time.perf_counter()
+        status = 'error'
         try:
-            async with httpx.AsyncClient() as client:
-                for _ in range(3):
-                    try:
-                        response = await client.get((self.klinehistoryurl if start else self.klineurl), params=query_params)
-                        break
-                    except (httpx.ConnectError, httpx.ConnectTimeout):
-                        continue
-                else:
-                    raise LookupError(f"Failed to fetch data from {self.NAME}")
-                response.raise_for_status()
+            client = upstream.client()
+            for _ in range(3):
+                try:
+                    with tracing.span('request', source=self.ID):
+                        response = await client.get((self.klinehistoryurl if start else self.klineurl), params=query_params, extensions=tracing.HTTPX_EXTENSIONS)
+                    break
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    continue
+                except httpx.TimeoutException as e:
+                    raise ds.UpstreamTimeout(f"Timed out fetching data from {self.NAME}: {e!r}") from e
+            else:
+                raise ds.UpstreamConnectError(f"Failed to fetch data from {self.NAME}")
+            status = str(response.status_code)
+            if response.status_code in (418, 429):
+                retry_after = response.headers.get('Retry-After', '')
+                metrics.UPSTREAM_RATE_LIMIT_WAIT.observe(float(retry_after) if retry_after.isdigit() else 0.0, self.ID)
+                raise ds.UpstreamRateLimited(f"Rate limited by {self.NAME}")
+            if response.status_code >= 500:
+                raise ds.UpstreamServerError(f"{self.NAME} answered {response.status_code}")
+            if response.status_code in (400, 404):
+                raise ds.SymbolNotListed(f"{self.symbol_name(base, quote)}:{interval} not listed on {self.NAME}")
+            response.raise_for_status()
+            with tracing.span('parse'):
                 klines = response.json()
-                for next in self.klinepath: klines = klines[next]
+            for next in self.klinepath: klines = klines[next]
+            with tracing.span('map', rows=len(klines)):
                 results = [self.kline_map(kline) for kline in klines]
-                if len(results) == 0:
-                    raise LookupError(f"No data found for {self.symbol_name(base, quote)}:{interval} start at {start} limit {limit}")
-                if len(results) > 1:
-                    if results[0]['timestamp'] > results[1]['timestamp']:
-                        results = results[::-1]
-                return results
-        except LookupError: raise
+            health.of(self.ID).success(time.perf_counter() - started)
+            if len(results) == 0:
+                status = 'empty'
+                # An empty history window is not proof the symbol is unlisted, an empty latest page is.
+                raise (LookupError if start else ds.SymbolNotListed)(f"No data found for {self.symbol_name(base, quote)}:{interval} start at {start} limit {limit}")
+            if len(results) > 1:
+                if results[0]['timestamp'] > results[1]['timestamp']:
+                    results = results[::-1]
+            return results
+        except ds.UpstreamError as e:
+            if status == 'error': status = e.kind
+            health.of(self.ID).failure(e.kind)
+            raise
+        except (LookupError, asyncio.CancelledError):
+            health.of(self.ID).abandon()
+            raise
         except Exception as e:
+            health.of(self.ID).abandon()
             raise LookupError(f"Failed to fetch latest data from {self.NAME}: {e}") from e
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.ID)
+            metrics.UPSTREAM_RESPONSES.inc(self.ID, status)
 
 
 class Binance(CexExchange):
     ID = 'binance'
     ORDER = 0
+    RATE_LIMIT = 20.0
     NAME = 'Binance'
     NETLOC = 'api.binance.com'
     PREFIX = '/api/v3'
@@ -175,6 +212,7 @@ class Binance(CexExchange):
     
     KLINE_QUERY = dict(interval='1m')
     KLINE_QUERY_LIMIT_PARAM = 'limit'
+    KLINE_MAX_LIMIT = 1000
     KLINE_QUERY_INTERVAL_PARAM = 'interval'
     KLINE_QUERY_START_PARAM = 'startTime'
     KLINE_QUERY_END_PARAM = 'endTime'
@@ -221,6 +259,7 @@ class Okx(CexExchange):
     KLINE_QUERY_SYMBOL_PARAM = 'instId'
     KLINE_QUERY_END_PARAM = 'after'
     KLINE_QUERY_LIMIT_PARAM  = 'limit'
+    KLINE_MAX_LIMIT = 100
     KLINE_QUERY_INTERVAL_PARAM = 'bar'
     KLINE_INTERVAL_MAPPER = {
         '1m': '1m',
@@ -266,6 +305,7 @@ class KuCoin(CexExchange):
     }
     KLINE_QUERY = dict(type='1min')
     KLINE_QUERY_START_PARAM = 'startAt'
+    KLINE_MAX_LIMIT = 1500
     KLINE_QUERY_INTERVAL_PARAM = 'type'
     KLINE_INTERVAL_MAPPER = {
         '1m': '1min',
@@ -305,6 +345,7 @@ class Bitget(CexExchange):
     KLINE_PATH = 'data'
     KLINE_QUERY = dict(granularity='1min')
     KLINE_QUERY_LIMIT_PARAM = 'limit'
+    KLINE_MAX_LIMIT = 200
     KLINE_QUERY_END_PARAM = 'startAt'
     KLINE_QUERY_INTERVAL_PARAM = 'granularity'
     KLINE_INTERVAL_MAPPER = {
@@ -363,6 +404,7 @@ class Mexc(CexExchange):
     
     KLINE_QUERY = dict(interval='1m')
     KLINE_QUERY_LIMIT_PARAM = 'limit'
+    KLINE_MAX_LIMIT = 1000
     KLINE_QUERY_START_PARAM = 'startTime'
     KLINE_QUERY_END_PARAM = 'endTime'
     KLINE_QUERY_INTERVAL_PARAM = 'interval'
@@ -400,6 +442,7 @@ class Gateio(CexExchange):
     
     KLINE_QUERY = dict(interval='1m')
     KLINE_QUERY_LIMIT_PARAM = 'limit'
+    KLINE_MAX_LIMIT = 1000
     KLINE_QUERY_START_PARAM = 'from'
     KLINE_QUERY_SYMBOL_PARAM = 'currency_pair'
     KLINE_QUERY_INTERVAL_PARAM = 'interval'
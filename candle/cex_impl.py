@@ -1,4 +1,6 @@
-from . import cex, datastruct as ds
+from . import cex, datastruct as ds, health
+from utils import metrics, tracing
+from utils.logger import logger
 import inspect
 import asyncio
 
@@ -32,22 +34,117 @@ class HTTPCEX(ds.CexCandleFactory):
         if interval not in cexes[exchange].KLINE_INTERVAL_MAPPER:
             raise ValueError('Invalid CEX Interval')
         self.cex = cexes[exchange]()
+        self.failover = False
+        self._unlisted: set[str] = set()
         super().__init__(self.cex.ID, symbol, interval)
 
+    @property
+    def rate_budget(self) -> tuple[str, float]:
+        """
+        The upstream whose request budget polling this tag spends, and its requests per second.
+        """
+        return self.cex.ID, self.cex.RATE_LIMIT
+
+    @property
+    def max_limit(self) -> int:
+        """
+        The most klines one request returns, from any exchange the tag may be routed to.
+        """
+        if not self.failover: return self.cex.KLINE_MAX_LIMIT
+        return min([self.cex.KLINE_MAX_LIMIT] + [alt.KLINE_MAX_LIMIT for alt in self._alternates()])
+
+    def enable_failover(self) -> None:
+        """
+        Allow hedging to and re-routing through the next exchanges by ORDER (used for wildcard tags).
+        """
+        self.failover = True
+
+    def _alternates(self) -> list[cex.CexExchange]:
+        ordered = sorted(cexes.values(), key=lambda x: x.ORDER)
+        index = ordered.index(type(self.cex))
+        return [
+            cex_type()
+            for cex_type in ordered[index + 1:] + ordered[:index]
+            if cex_type.ID not in self._unlisted and self.interval in cex_type.KLINE_INTERVAL_MAPPER
+        ]
+
+    async def _fetch_from(self, exchange: cex.CexExchange, start: int | None, limit: int | None) -> list[dict]:
+        if start is not None:
+            start *= 1000 if exchange.TS_UNIT else 1
+        try:
+            return await exchange.fetch(self.base, self.quote, start, limit, self.interval)
+        except ds.SymbolNotListed:
+            if exchange is not self.cex:
+                # The symbol is not listed there, don't hedge to it again.
+                self._unlisted.add(exchange.ID)
+            raise
+
+    async def _fetch(self, start: int | None = None, limit: int | None = None) -> list[dict]:
+        """
+        Fetch from the exchange of the tag, or, with failover enabled, re-route around an open
+        circuit breaker and race a hedged request once the primary is slower than its recent p95.
+        """
+        if not self.failover:
+            return await self._fetch_from(self.cex, start, limit)
+        alternates = iter(self._alternates())
+        primary = self.cex
+        if not health.of(primary.ID).allow():
+            primary = next((alt for alt in alternates if health.of(alt.ID).allow()), self.cex)
+            if primary is not self.cex:
+                metrics.UPSTREAM_HEDGES.inc(self.cex.ID, 'rerouted')
+        tasks = {asyncio.create_task(self._fetch_from(primary, start, limit)): primary}
+        error: BaseException | None = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=health.of(primary.ID).hedge_delay())
+            while True:
+                for task in done:
+                    exchange = tasks.pop(task)
+                    if task.exception() is None:
+                        metrics.UPSTREAM_HEDGES.inc(self.cex.ID, 'primary' if exchange is primary else 'hedge')
+                        return task.result()
+                    error = error or task.exception()
+                # Primary is slow or failed: hedge to the next exchange that is available.
+                hedge = next((alt for alt in alternates if health.of(alt.ID).allow()), None)
+                if hedge is not None:
+                    logger.debug(f'Hedging {self.base}-{self.quote} from {primary.ID} to {hedge.ID}')
+                    tasks[asyncio.create_task(self._fetch_from(hedge, start, limit))] = hedge
+                if not tasks:
+                    raise error or LookupError(f'No CEX can fetch {self.base}-{self.quote}')
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def candles(klines: list[dict]) -> list[ds.Candle]:
+        with tracing.span('validate', rows=len(klines)):
+            return [ds.Candle(**kline) for kline in klines]
+
     async def check(self) -> bool:
         return True
 
     async def fetch_newest(self) -> list[ds.Candle]:
-        klines = await self.cex.fetch(self.base, self.quote, limit=3, interval=self.interval)
-        return [ds.Candle(**kline) for kline in klines]
+        """
+        Only the candles after the cursor: the newest ones when they fit in one page and the exchange
+        takes a limit, otherwise a page starting right after the cursor, until the gap is caught up.
+        """
+        missing = self.missing()
+        if missing is None:
+            klines = await self._fetch(limit=3)
+        elif missing <= ds.POLL_MAX_LIMIT and self.cex.KLINE_QUERY_LIMIT_PARAM:
+            klines = await self._fetch(limit=missing)
+        else:
+            start, limit = self.cursor + self.interval_seconds, min(missing, ds.POLL_MAX_LIMIT)
+            return self.advance(self.candles(await self._fetch(start, limit)), start + (limit - 1) * self.interval_seconds)
+        return self.advance(self.candles(klines))
 
     async def fetch_history(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
-        klines = await self.cex.fetch(self.base, self.quote, start * (1000 if self.cex.TS_UNIT else 1), limit, self.interval)
-        return [ds.Candle(**kline) for kline in klines]
+        klines = await self._fetch(start, limit)
+        return self.candles(klines)
 
     async def fetch_latest(self) -> list[ds.Candle]:
-        klines = await self.cex.fetch(self.base, self.quote, interval=self.interval)
-        return [ds.Candle(**kline) for kline in klines]
+        klines = await self._fetch()
+        return self.advance(self.candles(klines))
 
 
 def init():
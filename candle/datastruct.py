@@ -1,5 +1,40 @@
 from abc import ABC, abstractmethod
 from pydantic import BaseModel
+import time
+import os
+
+
+# Most candles a single poll asks for; longer gaps are caught up over the next polls.
+POLL_MAX_LIMIT = int(os.getenv('POLL_MAX_LIMIT', 100))
+
+
+class UpstreamError(LookupError):
+    """
+    An upstream failure that tells about the health of the source rather than the requested symbol.
+    """
+    kind = 'error'
+
+
+class UpstreamTimeout(UpstreamError):
+    kind = 'timeout'
+
+
+class UpstreamConnectError(UpstreamError):
+    kind = 'connect_error'
+
+
+class UpstreamRateLimited(UpstreamError):
+    kind = 'rate_limited'
+
+
+class UpstreamServerError(UpstreamError):
+    kind = 'server_error'
+
+
+class SymbolNotListed(LookupError):
+    """
+    The source answered, and does not list the requested symbol or interval.
+    """
 
 
 class Candle(BaseModel):
@@ -11,7 +46,32 @@ class Candle(BaseModel):
     volume: float
 
 
+INTERVAL_SECONDS = {
+    '1s': 1,
+    '5s': 5,
+    '15s': 15,
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '30m': 1800,
+    '1h': 3600,
+    '4h': 14400,
+    '1d': 86400,
+    'smallest': 60,
+    None: 60,
+}
+
+
 class CandleFactory(ABC):
+    # Whether the `start` of fetch_history ends the range (candles before it) instead of beginning it.
+    HISTORY_BACKWARD = False
+    # Whether intervals without trades have no candle upstream, so holes are not gaps.
+    SPARSE = False
+    # Timestamp of the newest closed candle polled so far.
+    cursor: int | None = None
+    # Most candles one fetch_history call returns, None when the upstream does not cut pages short.
+    max_limit: int | None = None
+
     def __init__(self, interval: str) -> None:
         self._interval = interval
 
@@ -22,6 +82,37 @@ class CandleFactory(ABC):
         """
         return self._interval
 
+    @property
+    def interval_seconds(self) -> int:
+        """
+        The length of one candle in seconds.
+        """
+        return INTERVAL_SECONDS.get(self._interval, 60)
+
+    def missing(self) -> int | None:
+        """
+        How many candles opened after the cursor (the open one included), None before the first poll.
+        """
+        if self.cursor is None: return None
+        return max(1, int((time.time() - self.cursor) // self.interval_seconds))
+
+    def advance(self, candles: list[Candle], until: int | None = None) -> list[Candle]:
+        """
+        Move the cursor past a poll: to its newest closed candle, and over intervals without trades up
+        to `until` (by default the last closed interval, which a poll of the newest candles covers).
+        """
+        now = time.time()
+        interval = self.interval_seconds
+        cursor = int(now // interval) * interval - interval
+        if until is not None:
+            cursor = min(cursor, until)
+        for candle in reversed(candles):
+            if candle.timestamp + interval <= now:
+                cursor = max(cursor, candle.timestamp)
+                break
+        self.cursor = max(self.cursor or 0, cursor)
+        return candles
+
     @abstractmethod
     async def fetch_latest(self) -> list[Candle]:
         """
@@ -101,15 +192,26 @@ class CexCandleFactory(CandleFactory):
         return self._symbol
 
 
+class StreamCandleFactory(CexCandleFactory):
+    """
+    A CEX factory fed by a push stream, exposing `updates()` instead of being polled.
+    """
+    pass
+
+
 dex_cls: type[DexCandleFactory] | None = None
 cex_cls: type[CexCandleFactory] | None = None
+stream_cls: type[StreamCandleFactory] | None = None
 
 
 def register(factory: type[DexCandleFactory | CexCandleFactory]):
     """
     Register a CandleFactory.
     """
-    if issubclass(factory, DexCandleFactory):
+    if issubclass(factory, StreamCandleFactory):
+        global stream_cls
+        stream_cls = factory
+    elif issubclass(factory, DexCandleFactory):
         global dex_cls
         dex_cls = factory
     elif issubclass(factory, CexCandleFactory):
@@ -1,7 +1,10 @@
 from typing import Any
-from . import datastruct as ds
+from . import datastruct as ds, health
+from utils import metrics, tracing, upstream
 import json as jsonlib
 import httpx
+import time
+import os
 
 
 NETWORKS_SRC = jsonlib.load(open('gecko-networks.json', 'r', encoding='utf-8'))
@@ -14,6 +17,10 @@ NETWORKS = {
     for network in NETWORKS_SRC
 }
 
+# Longest a quiet pool goes without being polled, in broadcast periods.
+DEX_MAX_BACKOFF = max(1, int(os.getenv('DEX_MAX_BACKOFF', 16)))
+ACTIVITY_SMOOTHING = 0.2
+
 INTERVALS = {
     '1m': (1, 'minute'),
     '5m': (5, 'minute'),
@@ -31,6 +38,8 @@ class DexViewer:
     BASE_URL = 'https://api.geckoterminal.com/api/v2/networks/{network}/pools/{pool}/ohlcv/{timeframe}'
     START_PARAM = 'before_timestamp'
     LIMIT_PARAM = 'limit'
+    MAX_LIMIT = 1000
+    RATE_LIMIT = 0.5 # the public API allows 30 calls per minute
 
     def __init__(self, network: str, token: str, pool: str, interval: str | None = None):
         self.network = network
@@ -48,66 +57,148 @@ class DexViewer:
         self.base = None
         self.quote = None
 
+    @staticmethod
+    def candles(rows: list[list]) -> list[ds.Candle]:
+        return [
+            ds.Candle(
+                timestamp=int(row[0]),
+                open=float(row[1]),
+                high=float(row[2]),
+                low=float(row[3]),
+                close=float(row[4]),
+                volume=float(row[5]),
+            )
+            for row in rows
+        ]
+
+    @tracing.traced('dex.fetch')
     async def fetch(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
         query_params = self.query_params.copy()
         if start:
             query_params[self.START_PARAM] = start
         if limit:
             query_params[self.LIMIT_PARAM] = limit
+        started = time.perf_counter()
+        status = 'error'
         try:
-            async with httpx.AsyncClient() as client:
-                for _ in range(3):
-                    try:
-                        response = await client.get(self.url, params=query_params)
-                        break
-                    except (httpx.ConnectError, httpx.ConnectTimeout):
-                        continue
-                else:
-                    raise LookupError(f"Failed to fetch data from {self.tag}")
-                response.raise_for_status()
+            client = upstream.client()
+            for _ in range(3):
+                try:
+                    with tracing.span('request', source=self.ID):
+                        response = await client.get(self.url, params=query_params, extensions=tracing.HTTPX_EXTENSIONS)
+                    break
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    continue
+                except httpx.TimeoutException as e:
+                    raise ds.UpstreamTimeout(f"Timed out fetching {self.tag} from {self.NAME}: {e!r}") from e
+            else:
+                raise ds.UpstreamConnectError(f"Failed to fetch data from {self.tag}")
+            status = str(response.status_code)
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After', '')
+                metrics.UPSTREAM_RATE_LIMIT_WAIT.observe(float(retry_after) if retry_after.isdigit() else 0.0, self.ID)
+                raise ds.UpstreamRateLimited(f"Rate limited by {self.NAME}")
+            if response.status_code >= 500:
+                raise ds.UpstreamServerError(f"{self.NAME} answered {response.status_code}")
+            response.raise_for_status()
+            with tracing.span('parse'):
                 results: dict[str, Any] = response.json()
-                if 'error' in results:
-                    raise LookupError(f"Error from {self.tag}: {results['error']}")
-                meta: dict[str, dict[str, str]] = results.get('meta', {})
-                self.base = meta.get('base')
-                self.quote = meta.get('quote')
-                results: list[list] = results.get('data', {}).get('attributes', {}).get('ohlcv_list', [])
-                if len(results) == 0:
-                    raise LookupError(f"No data available for {self.tag}")
-                if len(results) > 1:
-                    if results[0][0] > results[-1][0]:
-                        results = results[::-1]
-                return [
-                    ds.Candle(
-                        timestamp=int(result[0]),
-                        open=float(result[1]),
-                        high=float(result[2]),
-                        low=float(result[3]),
-                        close=float(result[4]),
-                        volume=float(result[5]),
-                    )
-                    for result in results
-                ]
+            if 'error' in results:
+                raise LookupError(f"Error from {self.tag}: {results['error']}")
+            meta: dict[str, dict[str, str]] = results.get('meta', {})
+            self.base = meta.get('base')
+            self.quote = meta.get('quote')
+            results: list[list] = results.get('data', {}).get('attributes', {}).get('ohlcv_list', [])
+            health.of(self.ID).success(time.perf_counter() - started)
+            if len(results) == 0:
+                status = 'empty'
+                raise LookupError(f"No data available for {self.tag}")
+            if len(results) > 1:
+                if results[0][0] > results[-1][0]:
+                    results = results[::-1]
+            with tracing.span('validate', rows=len(results)):
+                return self.candles(results)
+        except ds.UpstreamError as e:
+            if status == 'error': status = e.kind
+            health.of(self.ID).failure(e.kind)
+            raise
         except LookupError: raise
         except Exception as e:
             raise LookupError(f"Error from {self.NAME}: {e}")
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.ID)
+            metrics.UPSTREAM_RESPONSES.inc(self.ID, status)
 
 
 class DexFactory(ds.DexCandleFactory):
+    """
+    Candles of a pool from GeckoTerminal. Pools that do not trade are polled less and less often:
+    after consecutive polls without a change, every 2, 4, ... up to DEX_MAX_BACKOFF periods, and
+    every period again as soon as a poll sees a change or a listener asks for history.
+    """
+    HISTORY_BACKWARD = True
+    SPARSE = True
+
     def __init__(self, network: str, address: str, pool: str, interval: str | None = None) -> None:
         if network not in NETWORKS:
             raise ValueError('Invalid Network')
         if interval not in INTERVALS:
             raise ValueError('Invalid Interval')
         self.viewer = DexViewer(network, address, pool, interval)
+        # Share of recent polls that saw the pool trade.
+        self.activity = 1.0
+        self._quiet = 0
+        self._skip = 0
+        self._last: tuple[int, float, float] | None = None
         super().__init__(network, address, pool, interval)
 
     @property
-    def info(self) -> dict[str, str]:
+    def backoff(self) -> int:
+        """
+        Periods between two polls of the pool
+        """
+        return min(DEX_MAX_BACKOFF, 2 ** max(0, self._quiet - 1))
+
+    def due(self) -> bool:
+        """
+        Whether to poll the pool this period
+        """
+        if self._skip > 0:
+            self._skip -= 1
+            return False
+        return True
+
+    def wake(self) -> None:
+        """
+        Back to polling every period
+        """
+        self._quiet = self._skip = 0
+
+    def _observe(self, candles: list[ds.Candle]) -> list[ds.Candle]:
+        last = (candles[-1].timestamp, candles[-1].close, candles[-1].volume) if candles else self._last
+        changed = last != self._last
+        self._last = last
+        self.activity += ACTIVITY_SMOOTHING * (changed - self.activity)
+        self._quiet = 0 if changed else self._quiet + 1
+        self._skip = self.backoff - 1
+        return candles
+
+    @property
+    def rate_budget(self) -> tuple[str, float]:
+        return self.viewer.ID, self.viewer.RATE_LIMIT
+
+    @property
+    def max_limit(self) -> int:
+        return self.viewer.MAX_LIMIT
+
+    @property
+    def info(self) -> dict[str, Any]:
         return {
             'token': self.address,
             'base': self.viewer.base,
             'quote': self.viewer.quote,
+            'activity': round(self.activity, 3),
+            'backoff': self.backoff,
         }
 
     async def check(self) -> bool:
@@ -118,13 +209,29 @@ class DexFactory(ds.DexCandleFactory):
             return False
 
     async def fetch_newest(self) -> list[ds.Candle]:
-        return await self.viewer.fetch(limit=3)
+        """
+        Only the candles after the cursor; a gap longer than a page is caught up oldest page first.
+        """
+        missing = self.missing()
+        if missing is None:
+            return self._observe(self.advance(await self.viewer.fetch(limit=3)))
+        if missing <= ds.POLL_MAX_LIMIT:
+            return self._observe(self.advance(await self.viewer.fetch(limit=missing)))
+        before = self.cursor + (ds.POLL_MAX_LIMIT + 1) * self.interval_seconds
+        try:
+            candles = await self.viewer.fetch(before, ds.POLL_MAX_LIMIT)
+        except ds.UpstreamError: raise
+        except LookupError:
+            # No trades in the whole page.
+            candles = []
+        # Catching up is not activity.
+        return self.advance(candles, before - self.interval_seconds)
 
     async def fetch_history(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
         return await self.viewer.fetch(start, limit)
 
     async def fetch_latest(self) -> list[ds.Candle]:
-        return await self.viewer.fetch()
+        return self._observe(self.advance(await self.viewer.fetch()))
 
 
 def init():
@@ -0,0 +1,94 @@
+from collections import deque
+from utils.logger import logger
+from utils import metrics
+import time
+import os
+
+
+LATENCY_WINDOW = int(os.getenv('HEALTH_LATENCY_WINDOW', 200))
+LATENCY_MIN_SAMPLES = int(os.getenv('HEALTH_LATENCY_MIN_SAMPLES', 20))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 0.2))
+HEDGE_DEFAULT_DELAY = float(os.getenv('HEDGE_DEFAULT_DELAY', 1.5))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', 30))
+
+
+class Health:
+    """
+    Recent latency and a circuit breaker for one upstream source.
+    """
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._p95: float | None = None
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None: return 'closed'
+        if time.monotonic() - self._opened_at < BREAKER_COOLDOWN: return 'open'
+        return 'half_open'
+
+    def p95(self) -> float | None:
+        if len(self._latencies) < LATENCY_MIN_SAMPLES: return None
+        if self._p95 is None:
+            ordered = sorted(self._latencies)
+            self._p95 = ordered[int(len(ordered) * 0.95) - 1]
+        return self._p95
+
+    def hedge_delay(self) -> float:
+        """
+        How long to wait on this source before sending a hedged request elsewhere.
+        """
+        p95 = self.p95()
+        return HEDGE_DEFAULT_DELAY if p95 is None else max(HEDGE_MIN_DELAY, p95)
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be routed to this source; a half-open breaker lets one probe through.
+        """
+        match self.state:
+            case 'closed': return True
+            case 'open': return False
+        if self._probing: return False
+        self._probing = True
+        return True
+
+    def abandon(self) -> None:
+        """
+        A request ended without telling about the health of the source (cancelled, e.g. outrun by a
+        hedge, or rejected for its parameters): let the next one probe.
+        """
+        self._probing = False
+
+    def success(self, latency: float) -> None:
+        self._latencies.append(latency)
+        self._p95 = None
+        self._failures = 0
+        self._probing = False
+        if self._opened_at is not None:
+            self._opened_at = None
+            metrics.UPSTREAM_BREAKER_OPEN.set(0, self.source)
+            logger.info(f'Circuit breaker for {self.source} closed')
+
+    def failure(self, kind: str) -> None:
+        self._failures += 1
+        self._probing = False
+        if self._opened_at is not None:
+            # A failed probe keeps the breaker open for another cooldown.
+            self._opened_at = time.monotonic()
+        elif self._failures >= BREAKER_FAILURES:
+            self._opened_at = time.monotonic()
+            metrics.UPSTREAM_BREAKER_OPEN.set(1, self.source)
+            logger.warning(f'Circuit breaker for {self.source} opened after {self._failures} failures (last: {kind})')
+
+
+_health: dict[str, Health] = {}
+
+
+def of(source: str) -> Health:
+    if source not in _health:
+        _health[source] = Health(source)
+    return _health[source]
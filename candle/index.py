@@ -0,0 +1,162 @@
+from typing import Any, AsyncIterator
+from . import cex_impl, datastruct as ds
+from utils.logger import logger
+import asyncio
+import os
+
+
+# How long to wait after a component update for the other exchanges of the same cycle.
+INDEX_SETTLE = float(os.getenv('INDEX_SETTLE', 1))
+
+
+class IndexFactory(ds.CexCandleFactory):
+    """
+    Composite candles of a symbol over every exchange listing it (`cex:index:<symbol>:<interval>`).
+
+    Each exchange is an ordinary tag of the manager. While the index is listened, its components are
+    registered and kept alive by a hold, shared with their direct listeners, and the index recomputes
+    the timestamps they broadcast; one-shot reads only fetch through them.
+    Prices are volume weighted; exchanges without volume (OKX index candles) weigh as much as the
+    average exchange with volume.
+    """
+    def __init__(self, manager: Any, symbol: str, interval: str | None = None) -> None:
+        # The components are tagged with the interval: `cex:index:<symbol>` builds on the `smallest` ones.
+        super().__init__('index', symbol, interval or 'smallest')
+        self._manager = manager
+        self._components: dict[str, Any] = {}
+        self._attached = False
+        self._changed: set[int] = set()
+        self._wake = asyncio.Event()
+
+    @property
+    def components(self) -> list[str]:
+        return list(self._components)
+
+    def _sink(self, candles: list[ds.Candle]) -> None:
+        self._changed.update(candle.timestamp for candle in candles)
+        self._wake.set()
+
+    async def _resolve(self) -> None:
+        for exchange in sorted(cex_impl.cexes.values(), key=lambda x: x.ORDER):
+            if self.interval not in exchange.KLINE_INTERVAL_MAPPER: continue
+            try:
+                resolved = await self._manager.resolve(f'cex:{exchange.ID}:{self.symbol}:{self.interval}')
+                if resolved is None: continue
+                _, csr = resolved
+                # Listing check: the window is cached and reused when the tag is listened.
+                await csr.latest()
+            except (ValueError, LookupError) as e:
+                logger.debug(f'{exchange.ID} left out of the {self.symbol} index: {e}')
+                continue
+            self._components[exchange.ID] = csr
+
+    async def check(self) -> bool:
+        if not self._components:
+            await self._resolve()
+        return bool(self._components)
+
+    async def _attach(self) -> None:
+        """
+        Register and hold the components, so they are polled and broadcast to the index
+        """
+        if self._attached: return
+        if not self._components:
+            await self._resolve()
+        listeners = self._manager.listeners
+        for exchange, csr in self._components.items():
+            if csr.tag in listeners:
+                csr = self._components[exchange] = listeners[csr.tag]
+            else:
+                listeners[csr.tag] = csr
+                logger.info(f'New Listener for {csr.tag} (index)')
+            csr.hold()
+            csr.add_sink(self._sink)
+        self._attached = True
+
+    def _detach(self) -> None:
+        """
+        Let go of the components; the ones nothing else needs linger like any unlistened tag
+        """
+        if not self._attached: return
+        self._attached = False
+        for csr in self._components.values():
+            csr.remove_sink(self._sink)
+            if not csr.release() and self._manager.listeners.get(csr.tag) is csr:
+                self._manager._linger(csr.tag)
+        # Resolved again (revived when still parked) on the next use.
+        self._components.clear()
+
+    def close(self) -> None:
+        self._detach()
+        for csr in self._components.values():
+            if self._manager.listeners.get(csr.tag) is not csr:
+                self._manager._close(csr)
+        self._components.clear()
+
+    def _combine(self, series: dict[str, list[ds.Candle]]) -> list[ds.Candle]:
+        rows: dict[int, list[tuple[bool, ds.Candle]]] = {}
+        for exchange, candles in series.items():
+            has_volume = cex_impl.cexes[exchange].KLINE_MAPPER.get('volume') is not None
+            for candle in candles:
+                rows.setdefault(candle.timestamp, []).append((has_volume, candle))
+        result = []
+        for timestamp in sorted(rows):
+            volumes = [candle.volume for has_volume, candle in rows[timestamp] if has_volume]
+            average = sum(volumes) / len(volumes) if volumes else 0.0
+            weights = [candle.volume if has_volume else average for has_volume, candle in rows[timestamp]]
+            total = sum(weights)
+            if total <= 0:
+                weights, total = [1.0] * len(weights), float(len(weights))
+            candles = [candle for _, candle in rows[timestamp]]
+            result.append(ds.Candle(
+                timestamp=timestamp,
+                open=sum(w * c.open for w, c in zip(weights, candles)) / total,
+                high=sum(w * c.high for w, c in zip(weights, candles)) / total,
+                low=sum(w * c.low for w, c in zip(weights, candles)) / total,
+                close=sum(w * c.close for w, c in zip(weights, candles)) / total,
+                volume=sum(volumes),
+            ))
+        return result
+
+    async def updates(self) -> AsyncIterator[list[ds.Candle]]:
+        """
+        Yield the recomputed candles after components broadcast, holding the components meanwhile
+        """
+        await self._attach()
+        try:
+            while True:
+                await self._wake.wait()
+                await asyncio.sleep(INDEX_SETTLE)
+                self._wake.clear()
+                changed, self._changed = self._changed, set()
+                series = {
+                    exchange: [candle for candle in map(csr.candle, sorted(changed)) if candle is not None]
+                    for exchange, csr in self._components.items()
+                }
+                candles = self._combine(series)
+                if candles:
+                    yield candles
+        finally:
+            self._detach()
+
+    async def fetch_latest(self) -> list[ds.Candle]:
+        if not self._components:
+            await self._resolve()
+        windows = await asyncio.gather(*[csr.latest() for csr in self._components.values()], return_exceptions=True)
+        return self._combine({
+            exchange: window
+            for exchange, window in zip(self._components, windows)
+            if not isinstance(window, BaseException)
+        })
+
+    async def fetch_newest(self) -> list[ds.Candle]:
+        return (await self.fetch_latest())[-2:]
+
+    async def fetch_history(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
+        if not self._components:
+            await self._resolve()
+        pages = await asyncio.gather(*[csr.history(start, limit) for csr in self._components.values()], return_exceptions=True)
+        series = {exchange: page for exchange, page in zip(self._components, pages) if not isinstance(page, BaseException)}
+        if not series:
+            raise LookupError(f'No CEX can fetch the history of {self.symbol}')
+        return self._combine(series)
@@ -0,0 +1,249 @@
+from typing import Any
+from abc import ABC, abstractmethod
+from collections import deque
+from . import datastruct as ds
+import math
+import os
+
+
+MAX_PERIOD = int(os.getenv('INDICATOR_MAX_PERIOD', 500))
+MAX_INDICATORS = int(os.getenv('INDICATOR_MAX_PER_LISTEN', 10))
+
+
+class Indicator(ABC):
+    """
+    Indicator over a candle series, updated in O(1) per candle.
+
+    `step` commits a closed candle into the state, `peek` computes the value with a still open candle
+    as the newest one without committing it, so the open candle can be updated any number of times.
+    """
+    NAME = ''
+    PARAMS: dict[str, int | float] = {}
+
+    def __init__(self, **params: int | float) -> None:
+        self.params = params
+        self._pending: ds.Candle | None = None
+
+    @abstractmethod
+    def step(self, candle: ds.Candle) -> None:
+        """
+        Commit a closed candle into the state.
+        """
+        pass
+
+    @abstractmethod
+    def peek(self, candle: ds.Candle) -> float | dict[str, float] | None:
+        """
+        The value with `candle` as the newest candle, without committing it.
+        """
+        pass
+
+    def update(self, candle: ds.Candle) -> float | dict[str, float] | None:
+        if self._pending is not None:
+            if candle.timestamp < self._pending.timestamp: return None
+            if candle.timestamp > self._pending.timestamp:
+                self.step(self._pending)
+        self._pending = candle
+        return self.peek(candle)
+
+    def points(self, candles: list[ds.Candle]) -> list[dict[str, Any]]:
+        """
+        Feed candles in order, and return the values that are defined
+        """
+        result = []
+        for candle in candles:
+            value = self.update(candle)
+            if value is not None:
+                result.append({'timestamp': candle.timestamp, 'value': value})
+        return result
+
+
+class Sma(Indicator):
+    NAME = 'sma'
+    PARAMS = {'period': 20}
+
+    def __init__(self, **params: int | float) -> None:
+        super().__init__(**params)
+        self._period = int(params['period'])
+        self._closes: deque[float] = deque(maxlen=self._period)
+        self._sum = 0.0
+
+    def step(self, candle: ds.Candle) -> None:
+        if len(self._closes) == self._period:
+            self._sum -= self._closes[0]
+        self._closes.append(candle.close)
+        self._sum += candle.close
+
+    def peek(self, candle: ds.Candle) -> float | None:
+        if len(self._closes) < self._period - 1: return None
+        total = self._sum + candle.close
+        if len(self._closes) == self._period:
+            total -= self._closes[0]
+        return total / self._period
+
+
+class Ema(Indicator):
+    NAME = 'ema'
+    PARAMS = {'period': 20}
+
+    def __init__(self, **params: int | float) -> None:
+        super().__init__(**params)
+        self._alpha = 2 / (int(params['period']) + 1)
+        self._ema: float | None = None
+
+    def step(self, candle: ds.Candle) -> None:
+        self._ema = self.peek(candle)
+
+    def peek(self, candle: ds.Candle) -> float:
+        if self._ema is None: return candle.close
+        return self._ema + self._alpha * (candle.close - self._ema)
+
+
+class Rsi(Indicator):
+    NAME = 'rsi'
+    PARAMS = {'period': 14}
+
+    def __init__(self, **params: int | float) -> None:
+        super().__init__(**params)
+        self._period = int(params['period'])
+        self._close: float | None = None
+        self._gain = 0.0
+        self._loss = 0.0
+        self._count = 0
+
+    def _next(self, candle: ds.Candle) -> tuple[float, float, int]:
+        if self._close is None: return 0.0, 0.0, 0
+        change = candle.close - self._close
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        count = self._count + 1
+        # Simple average over the first period, Wilder's smoothing afterwards.
+        n = min(count, self._period)
+        return self._gain + (gain - self._gain) / n, self._loss + (loss - self._loss) / n, count
+
+    def step(self, candle: ds.Candle) -> None:
+        self._gain, self._loss, self._count = self._next(candle)
+        self._close = candle.close
+
+    def peek(self, candle: ds.Candle) -> float | None:
+        gain, loss, count = self._next(candle)
+        if count < self._period: return None
+        if loss == 0: return 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+
+class Vwap(Indicator):
+    """
+    Volume weighted typical price, reset at every UTC day.
+    """
+    NAME = 'vwap'
+    PARAMS = {}
+
+    def __init__(self, **params: int | float) -> None:
+        super().__init__(**params)
+        self._day: int | None = None
+        self._pv = 0.0
+        self._volume = 0.0
+
+    def _next(self, candle: ds.Candle) -> tuple[int, float, float]:
+        day = candle.timestamp // 86400
+        pv, volume = (self._pv, self._volume) if day == self._day else (0.0, 0.0)
+        return day, pv + (candle.high + candle.low + candle.close) / 3 * candle.volume, volume + candle.volume
+
+    def step(self, candle: ds.Candle) -> None:
+        self._day, self._pv, self._volume = self._next(candle)
+
+    def peek(self, candle: ds.Candle) -> float | None:
+        _, pv, volume = self._next(candle)
+        return pv / volume if volume else None
+
+
+class Bollinger(Sma):
+    NAME = 'bollinger'
+    PARAMS = {'period': 20, 'k': 2.0}
+
+    def __init__(self, **params: int | float) -> None:
+        super().__init__(**params)
+        self._k = float(params['k'])
+        self._squares = 0.0
+
+    def step(self, candle: ds.Candle) -> None:
+        if len(self._closes) == self._period:
+            self._squares -= self._closes[0] ** 2
+        self._squares += candle.close ** 2
+        super().step(candle)
+
+    def peek(self, candle: ds.Candle) -> dict[str, float] | None:
+        middle = super().peek(candle)
+        if middle is None: return None
+        squares = self._squares + candle.close ** 2
+        if len(self._closes) == self._period:
+            squares -= self._closes[0] ** 2
+        deviation = math.sqrt(max(0.0, squares / self._period - middle ** 2))
+        return {'middle': middle, 'upper': middle + self._k * deviation, 'lower': middle - self._k * deviation}
+
+
+INDICATORS: dict[str, type[Indicator]] = {cls.NAME: cls for cls in (Sma, Ema, Rsi, Vwap, Bollinger)}
+
+
+def parse(specs: Any) -> list[tuple[str, type[Indicator], dict[str, int | float]]]:
+    """
+    Validate the `indicators` of a listen message, and return (id, class, params) of each distinct one
+    """
+    if not isinstance(specs, list):
+        raise ValueError('Invalid indicators: must be a list')
+    if len(specs) > MAX_INDICATORS:
+        raise ValueError(f'Too many indicators: at most {MAX_INDICATORS} per listen')
+    result = {}
+    for spec in specs:
+        name = spec.get('name') if isinstance(spec, dict) else spec
+        if not isinstance(name, str) or name not in INDICATORS:
+            raise ValueError(f'Unknown indicator {name}')
+        cls = INDICATORS[name]
+        params: dict[str, int | float] = {}
+        for param, default in cls.PARAMS.items():
+            try:
+                value = type(default)(spec.get(param, default) if isinstance(spec, dict) else default)
+            except (TypeError, ValueError):
+                raise ValueError(f'Invalid {param} for {name}')
+            if not 0 < value <= MAX_PERIOD:
+                raise ValueError(f'Invalid {param} for {name}: must be between 0 and {MAX_PERIOD}')
+            params[param] = value
+        key = f'{name}({",".join(str(value) for value in params.values())})' if params else name
+        result[key] = (key, cls, params)
+    return list(result.values())
+
+
+class Series:
+    """
+    One indicator of one tag, computed once and shared by every listener that asked for it.
+    """
+    def __init__(self, key: str, indicator: Indicator, candles: list[ds.Candle], limit: int) -> None:
+        self.key = key
+        self.indicator = indicator
+        self.limit = limit
+        self.listeners: set[Any] = set()
+        self.points = indicator.points(candles)[-limit:]
+
+    def reseed(self, candles: list[ds.Candle], since: int) -> list[dict[str, Any]]:
+        """
+        Recompute from scratch after candles were inserted into the past, and return the points from
+        `since` on
+        """
+        self.indicator = type(self.indicator)(**self.indicator.params)
+        self.points = self.indicator.points(candles)[-self.limit:]
+        return [point for point in self.points if point['timestamp'] >= since]
+
+    def update(self, candles: list[ds.Candle]) -> list[dict[str, Any]]:
+        """
+        Feed new candles, and return the points they changed or added
+        """
+        points = self.indicator.points(candles)
+        if points:
+            first = points[0]['timestamp']
+            index = len(self.points)
+            while index and self.points[index - 1]['timestamp'] >= first:
+                index -= 1
+            self.points[index:] = points
+            if len(self.points) > self.limit:
+                del self.points[:len(self.points) - self.limit]
+        return points
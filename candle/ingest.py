@@ -0,0 +1,227 @@
+"""
+Dedicated ingest process.
+
+Polls upstream for every tag some web worker listens to and publishes the candles into one shared
+memory ring per tag (see candle.shm). Web workers started with `CANDLE_ROLE=web` attach to those
+rings and only fan out, so adding workers does not multiply upstream traffic:
+
+    python -m candle.ingest
+    CANDLE_ROLE=web uvicorn app:app --workers 4
+
+Workers talk to this process over a Unix socket (`INGEST_SOCKET`) with one JSON object per line:
+`check` a tag and read its `latest` candles or `history` without holding it, `acquire`/`release` a
+listened tag, `wake` a pool polled less while quiet, and resolve a wildcard exchange (`first_cex`).
+"""
+from typing import Any, AsyncIterator, Callable
+from collections import Counter
+from contextlib import asynccontextmanager
+from . import CandleManager, cex_impl, datastruct as ds, dex, stream
+from .manager import CandleSenderReceiver, dumps
+from .shm import CandleRing, INGEST_SOCKET
+from utils.logger import logger
+from utils import metrics, upstream
+import json as jsonlib
+import asyncio
+import signal
+import os
+
+
+rings: dict[str, CandleRing] = {}
+# Written into every ring, so workers still mapping the rings of a previous run notice the restart.
+GENERATION = int.from_bytes(os.urandom(8), 'little')
+
+
+def publisher(ring: CandleRing, csr: CandleSenderReceiver) -> Callable[[list[ds.Candle]], None]:
+    """
+    Sink writing a tag's broadcasts into its ring, along with the cadence the rationer gave the tag
+    """
+    def publish(candles: list[ds.Candle]) -> None:
+        ring.cadence = csr.cadence
+        ring.write(candles)
+    return publish
+
+
+async def acquire(tag: str, failover: bool = False) -> dict[str, Any]:
+    resolved = await CandleManager.resolve(tag)
+    if resolved is None:
+        raise ValueError(f'Invalid Tag {tag}')
+    tag, csr = resolved
+    if tag in CandleManager.listeners:
+        csr = CandleManager.listeners[tag]
+    else:
+        admission = CandleManager.admission(csr)
+        metrics.ADMISSIONS.inc(csr.source, admission)
+        if admission != 'admitted':
+            # The worker queues or rejects the listen, and asks again.
+            CandleManager._close(csr)
+            return {'tag': tag, 'admission': admission}
+        if failover and hasattr(csr.factory, 'enable_failover'):
+            csr.factory.enable_failover()
+        CandleManager.listeners[tag] = csr
+        csr.start_stream()
+        logger.info(f'Publishing {tag}')
+    csr.hold()
+    try:
+        latest = await csr.latest()
+    except BaseException:
+        release(tag)
+        raise
+    if tag not in rings:
+        ring = rings[tag] = CandleRing.create(tag, generation=GENERATION)
+        csr.add_sink(publisher(ring, csr))
+        ring.write(latest)
+    result: dict[str, Any] = {'tag': tag, 'shm': rings[tag].name, 'generation': GENERATION}
+    if hasattr(csr.factory, 'info'):
+        result['info'] = csr.factory.info
+    return result
+
+
+def release(tag: str) -> None:
+    csr = CandleManager.listeners.get(tag)
+    if csr is None or csr.release(): return
+    CandleManager._drop(tag)
+    ring = rings.pop(tag, None)
+    if ring is not None:
+        ring.close()
+
+
+@asynccontextmanager
+async def reading(tag: str) -> AsyncIterator[CandleSenderReceiver]:
+    """
+    The sender/receiver serving one read for a worker; a trade stream nobody listens to is not kept
+    by the reader LRU (see CandleManager.reader), it is opened for the read and closed after it
+    """
+    if tag.split(':', 1)[0] != 'stream' or tag in CandleManager.listeners:
+        yield await CandleManager.reader(tag)
+        return
+    resolved = await CandleManager.resolve(tag)
+    if resolved is None:
+        raise ValueError(f'Invalid Tag {tag}')
+    try:
+        yield resolved[1]
+    finally:
+        CandleManager._close(resolved[1])
+
+
+async def check(tag: str, failover: bool = False) -> dict[str, Any]:
+    """
+    Resolve a tag for a worker without holding it, along with the admission a listen would get now
+    """
+    async with reading(tag) as csr:
+        if failover and hasattr(csr.factory, 'enable_failover'):
+            csr.factory.enable_failover()
+        admission = 'admitted' if csr.tag in CandleManager.listeners else CandleManager.admission(csr)
+        result: dict[str, Any] = {'tag': csr.tag, 'admission': admission}
+        if hasattr(csr.factory, 'info'):
+            result['info'] = csr.factory.info
+        return result
+
+
+async def latest(tag: str) -> list[dict[str, Any]]:
+    async with reading(tag) as csr:
+        return [candle.model_dump() for candle in await csr.latest()]
+
+
+async def history(tag: str, start: int | None, limit: int | None) -> list[dict[str, Any]]:
+    async with reading(tag) as csr:
+        return [candle.model_dump() for candle in await csr.history(start, limit)]
+
+
+def wake(tag: str) -> None:
+    csr = CandleManager.listeners.get(tag)
+    if csr is not None and hasattr(csr.factory, 'wake'):
+        csr.factory.wake()
+
+
+async def first_cex(args: list[str]) -> str | None:
+    if ds.cex_cls is None or not hasattr(ds.cex_cls, 'check_first_cex'):
+        raise ValueError('CEX Candle Factory not support wildcard')
+    return await ds.cex_cls.check_first_cex(*args)
+
+
+async def answer(held: Counter[str], request: dict[str, Any]) -> dict[str, Any]:
+    match request.get('op'):
+        case 'acquire':
+            result = await acquire(request['tag'], request.get('failover', False))
+            if 'shm' in result:
+                held[result['tag']] += 1
+            return result
+        case 'release':
+            if held[request['tag']] > 0:
+                held[request['tag']] -= 1
+                release(request['tag'])
+            return {}
+        case 'check':
+            return await check(request['tag'], request.get('failover', False))
+        case 'latest':
+            return {'data': await latest(request['tag'])}
+        case 'history':
+            return {'data': await history(request['tag'], request.get('start'), request.get('limit'))}
+        case 'wake':
+            wake(request['tag'])
+            return {}
+        case 'first_cex':
+            return {'exchange': await first_cex(request['args'])}
+        case op:
+            raise ValueError(f'Unknown op {op}')
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """
+    Serve one web worker; everything it acquired is released when it goes away
+    """
+    held: Counter[str] = Counter()
+
+    async def reply(request: dict[str, Any]) -> None:
+        try:
+            response = {'status': 'success', **await answer(held, request)}
+        except (ValueError, LookupError) as e:
+            response = {'status': 'error', 'message': str(e)}
+        except Exception as e:
+            logger.exception(f'Error while serving {request.get("op")}: {e}')
+            response = {'status': 'error', 'message': f'Internal error: {e}'}
+        response['id'] = request.get('id')
+        writer.write(dumps(response).encode() + b'\n')
+
+    tasks: set[asyncio.Task[None]] = set()
+    try:
+        while line := await reader.readline():
+            task = asyncio.create_task(reply(jsonlib.loads(line)))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (ConnectionError, ValueError) as e:
+        logger.warning(f'Worker connection failed: {e}')
+    finally:
+        for task in tasks:
+            task.cancel()
+        for tag, count in held.items():
+            for _ in range(count):
+                release(tag)
+        writer.close()
+
+
+async def main() -> None:
+    # Whatever role the environment names, this process is the one talking to upstream.
+    cex_impl.init()
+    dex.init()
+    stream.init()
+    if os.path.exists(INGEST_SOCKET):
+        os.unlink(INGEST_SOCKET)
+    server = await asyncio.start_unix_server(handle, path=INGEST_SOCKET)
+    # Unlink the rings on a plain `kill` too.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    logger.info(f'Ingest listening on {INGEST_SOCKET}')
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), CandleManager.run())
+    finally:
+        for ring in rings.values():
+            ring.close()
+        rings.clear()
+        await upstream.aclose()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError): pass
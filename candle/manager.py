@@ -1,6 +1,77 @@
-from . import datastruct
+from typing import Any, Callable
+from collections import OrderedDict, deque
+from . import datastruct, indicators
+from .index import IndexFactory
 from fastapi import WebSocket, WebSocketDisconnect
 from utils.logger import logger
+from utils import metrics, tracing
+from utils.ratelimit import TokenBucket
+from utils.profiler import profiler
+import functools
+import bisect
+import random
+import json as jsonlib
+import asyncio
+import time
+import sys
+import os
+
+
+BROADCAST_PERIOD = int(os.getenv('BROADCAST_PERIOD', 60))
+MAX_SUBSCRIPTIONS = int(os.getenv('MAX_SUBSCRIPTIONS_PER_SOCKET', 50))
+WINDOW_LIMIT = int(os.getenv('CANDLE_WINDOW_LIMIT', 1000))
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', 64))
+READER_CACHE_SIZE = int(os.getenv('READER_CACHE_SIZE', 256))
+HISTORY_PAGE = int(os.getenv('HISTORY_PAGE', 100))
+HISTORY_MAX_LIMIT = int(os.getenv('HISTORY_MAX_LIMIT', 1000))
+HISTORY_RATE = float(os.getenv('HISTORY_RATE', 1))
+HISTORY_BURST = float(os.getenv('HISTORY_BURST', 5))
+LINGER_SECONDS = float(os.getenv('LINGER_SECONDS', 300))
+LINGER_BUDGET = int(os.getenv('LINGER_BUDGET', 64 * 1024 * 1024))
+SCHEDULE_WINDOW = min(float(os.getenv('SCHEDULE_WINDOW', 5)), BROADCAST_PERIOD / 2)
+SCHEDULE_JITTER = float(os.getenv('SCHEDULE_JITTER', 0.5))
+POLL_BUDGET_SHARE = float(os.getenv('POLL_BUDGET_SHARE', 0.8))
+SCHEDULE_MAX_CADENCE = max(1, int(os.getenv('SCHEDULE_MAX_CADENCE', 10)))
+# What happens to a new tag once its upstream is at capacity: `admit`, `queue` or `reject`.
+ADMISSION_POLICY = os.getenv('ADMISSION_POLICY', 'admit')
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 100))
+REPLAY_WINDOW = int(os.getenv('REPLAY_WINDOW', 120))
+
+def _candle_size() -> int:
+    sample = datastruct.Candle(timestamp=0, open=0.0, high=0.0, low=0.0, close=0.0, volume=0.0)
+    fields = vars(sample)
+    return sys.getsizeof(sample) + sys.getsizeof(fields) + sum(sys.getsizeof(value) for value in fields.values())
+
+
+CANDLE_SIZE = _candle_size()
+
+
+def capacity(rate: float) -> int:
+    """
+    Polls an upstream allowing `rate` requests per second takes per period, leaving POLL_BUDGET_SHARE
+    of it for polls and the rest for history and backfill requests
+    """
+    return max(1, int(rate * BROADCAST_PERIOD * POLL_BUDGET_SHARE))
+
+
+def full_cadence(capacity: int, count: int) -> int:
+    """
+    How many of `count` tags ranked by priority are polled every period; the others share the remaining
+    polls and are each refreshed at least every SCHEDULE_MAX_CADENCE periods
+    """
+    if count <= capacity or SCHEDULE_MAX_CADENCE == 1: return count
+    return max(0, (capacity * SCHEDULE_MAX_CADENCE - count) // (SCHEDULE_MAX_CADENCE - 1))
+
+dumps = functools.partial(jsonlib.dumps, separators=(',', ':'), ensure_ascii=False)
+
+
+async def send(ws: WebSocket, message: dict[str, Any]) -> None:
+    """
+    Serialize and send a frame, accounting its size
+    """
+    payload = dumps(message)
+    await ws.send_text(payload)
+    metrics.BYTES_SENT.inc(message['type'], value=len(payload))
 
 
 class CandleSenderReceiver:
@@ -8,6 +79,23 @@ class CandleSenderReceiver:
         self._tag = tag
         self._listeners: set[WebSocket] = set()
         self._factory = factory
+        self._source = getattr(factory, 'exchange', None) or getattr(factory, 'chain', None) or 'unknown'
+        self._window: list[datastruct.Candle] = []
+        self._refreshed = 0.0
+        self._refreshing: asyncio.Future[list[datastruct.Candle]] | None = None
+        self._history: OrderedDict[tuple[int | None, int | None], list[datastruct.Candle]] = OrderedDict()
+        self._history_inflight: dict[tuple[int | None, int | None], asyncio.Future[list[datastruct.Candle]]] = {}
+        self._holds = 0
+        self._stream: asyncio.Task[None] | None = None
+        self._indicators: dict[str, indicators.Series] = {}
+        self._sinks: list[Callable[[list[datastruct.Candle]], Any]] = []
+        self._checked: int | None = None
+        # Polled once every `cadence` periods when its upstream cannot refresh every tag.
+        self.cadence = 1
+        # Sequence of the last update/backfill frame; starting from the creation time in milliseconds
+        # keeps it increasing when the tag is dropped and created again.
+        self._seq = time.time_ns() // 1_000_000 * 1000
+        self._log: deque[tuple[int, str]] = deque(maxlen=REPLAY_WINDOW)
 
     @property
     def tag(self) -> str:
@@ -16,54 +104,415 @@ class CandleSenderReceiver:
         """
         return self._tag
 
-    async def add_listener(self, ws: WebSocket) -> None:
+    @property
+    def listener_count(self) -> int:
+        """
+        the number of sockets listening to the tag
+        """
+        return len(self._listeners)
+
+    @property
+    def demand(self) -> int:
+        """
+        the number of sockets and holds needing the tag
+        """
+        return len(self._listeners) + self._holds
+
+    @property
+    def degraded(self) -> dict[str, Any]:
+        """
+        the fields telling listeners the tag is refreshed less often than every period, if it is
+        """
+        # Rationed here, or in the ingest process for remote factories.
+        cadence = max(self.cadence, getattr(self._factory, 'cadence', 1))
+        if cadence <= 1: return {}
+        return {'degraded': True, 'cadence': cadence * BROADCAST_PERIOD}
+
+    @property
+    def source(self) -> str:
+        """
+        the exchange or chain of the tag
+        """
+        return self._source
+
+    @property
+    def factory(self) -> datastruct.CandleFactory:
+        """
+        the factory feeding the tag
+        """
+        return self._factory
+
+    def hold(self) -> None:
+        """
+        Keep the tag alive without a socket listening to it
+        """
+        self._holds += 1
+
+    def release(self) -> bool:
+        """
+        Drop one hold, and return if the tag is still needed
+        """
+        self._holds = max(0, self._holds - 1)
+        return len(self._listeners) > 0 or self._holds > 0
+
+    def add_sink(self, sink: Callable[[list[datastruct.Candle]], Any]) -> None:
+        """
+        Also hand every broadcast to `sink`, e.g. to publish it out of process
+        """
+        self._sinks.append(sink)
+
+    def remove_sink(self, sink: Callable[[list[datastruct.Candle]], Any]) -> None:
+        self._sinks.remove(sink)
+
+    def candle(self, timestamp: int) -> datastruct.Candle | None:
+        """
+        The candle of the window opened at `timestamp`, if any
+        """
+        index = bisect.bisect_left(self._window, timestamp, key=lambda candle: candle.timestamp)
+        if index < len(self._window) and self._window[index].timestamp == timestamp:
+            return self._window[index]
+        return None
+
+    @property
+    def streaming(self) -> bool:
+        """
+        whether the factory pushes updates instead of being polled
+        """
+        return hasattr(self._factory, 'updates')
+
+    def due(self) -> bool:
+        """
+        Whether to poll the tag this period; factories may skip periods while their market is quiet
+        """
+        due = getattr(self._factory, 'due', None)
+        return due is None or due()
+
+    def start_stream(self) -> None:
+        """
+        Broadcast every update the factory pushes, until stop_stream
+        """
+        if self.streaming and self._stream is None:
+            self._stream = asyncio.create_task(self._pump(), name=f'Stream:{self.tag}')
+
+    def stop_stream(self) -> None:
+        if self._stream is not None:
+            self._stream.cancel()
+            self._stream = None
+
+    async def _pump(self) -> None:
+        updates = self._factory.updates()
+        try:
+            async for candles in updates:
+                self._merge(candles)
+                try:
+                    await self.broadcast(candles)
+                    await self.backfill()
+                except Exception as e:
+                    logger.warning(f'Error while broadcasting {self.tag}: {e}')
+        finally:
+            # Run the factory's cleanup now, even when cancelled outside the generator.
+            await updates.aclose()
+
+    def touch(self) -> None:
+        """
+        Treat the window as fresh, e.g. when a parked tag is listened again
+        """
+        if self._window:
+            self._refreshed = time.time()
+
+    def footprint(self) -> int:
+        """
+        Estimated bytes held by the cached candles of the tag
+        """
+        candles = len(self._window) + sum(len(page) for page in self._history.values())
+        return CANDLE_SIZE * candles + sum(len(payload) for _, payload in self._log)
+
+    def closed(self, candle: datastruct.Candle) -> bool:
+        """
+        Whether the candle can no longer change
+        """
+        return candle.timestamp + self._factory.interval_seconds <= time.time()
+
+    def settled(self, start: int | None, limit: int | None) -> bool:
+        """
+        Whether every candle a history request can return is closed, judged from the requested range
+        rather than from what upstream returned (which may lag behind or be sparse)
+        """
+        if not start: return False
+        interval = self._factory.interval_seconds
+        boundary = int(time.time()) // interval * interval
+        if self._factory.HISTORY_BACKWARD:
+            return start <= boundary
+        return bool(limit) and start + limit * interval <= boundary
+
+    def _merge(self, candles: list[datastruct.Candle]) -> None:
+        if not candles: return
+        first = candles[0].timestamp
+        index = len(self._window)
+        while index and self._window[index - 1].timestamp >= first:
+            index -= 1
+        tail = self._window[index:]
+        if tail:
+            # Keep the candles the update does not carry, e.g. when an index recomputes a backfilled
+            # timestamp along with the newest one.
+            merged = {candle.timestamp: candle for candle in tail}
+            merged.update((candle.timestamp, candle) for candle in candles)
+            candles = [merged[timestamp] for timestamp in sorted(merged)]
+        self._window[index:] = candles
+        if len(self._window) > WINDOW_LIMIT:
+            del self._window[:len(self._window) - WINDOW_LIMIT]
+        self._refreshed = time.time()
+
+    async def _refresh(self) -> list[datastruct.Candle]:
+        try:
+            latest = await self._factory.fetch_latest()
+            self._window = []
+            self._merge(latest)
+            return list(self._window)
+        finally:
+            self._refreshing = None
+
+    async def latest(self) -> list[datastruct.Candle]:
+        """
+        The latest candles, fetched at most once per broadcast period and shared by every reader
+        """
+        if self._window and time.time() - self._refreshed < BROADCAST_PERIOD:
+            metrics.CACHE_REQUESTS.inc('latest', 'hit')
+            return list(self._window)
+        metrics.CACHE_REQUESTS.inc('latest', 'miss')
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    def _sequence(self, frame: dict[str, Any]) -> str:
+        """
+        Number and serialize a frame for all listeners, keeping it for the ones coming back
+        """
+        self._seq += 1
+        payload = dumps({**frame, 'tag': self.tag, 'seq': self._seq})
+        self._log.append((self._seq, payload))
+        return payload
+
+    def _forget(self) -> None:
+        """
+        Skip a frame nobody listens to; the log no longer covers what was missed
+        """
+        self._seq += 1
+        self._log.clear()
+
+    def replay(self, seq: int) -> list[tuple[int, str]] | None:
+        """
+        The frames after `seq`, or None when the log no longer has all of them
+        """
+        if seq == self._seq: return []
+        if seq > self._seq or not self._log or self._log[0][0] > seq + 1: return None
+        return [(number, payload) for number, payload in self._log if number > seq]
+
+    async def resume(self, ws: WebSocket, seq: int) -> bool:
+        """
+        Register a listener coming back after frame `seq` by sending only the frames it missed, and
+        return False if they are out of the replay window
+        """
+        frames = self.replay(seq)
+        if frames is None:
+            metrics.CACHE_REQUESTS.inc('replay', 'miss')
+            return False
+        metrics.CACHE_REQUESTS.inc('replay', 'hit')
+        await send(ws, {'type': 'resume', 'status': 'success', 'tag': self.tag, 'seq': seq, 'missed': len(frames), **self.degraded})
+        # Frames broadcast while sending are caught up before joining the listeners.
+        while frames:
+            for seq, payload in frames:
+                await ws.send_text(payload)
+                metrics.BYTES_SENT.inc('resume', value=len(payload))
+            frames = self.replay(seq)
+            if frames is None:
+                return False
+        self._listeners.add(ws)
+        return True
+
+    async def add_listener(self, ws: WebSocket, resume: int | None = None) -> None:
         """
         Register a new listener to the manager
         """
-        latest = await self._factory.fetch_latest()
+        if resume is not None and await self.resume(ws, resume): return
+        latest = await self.latest()
         self._listeners.add(ws)
         if hasattr(self._factory, 'info'):
-            return await ws.send_json({
+            return await send(ws, {
                 'type': 'init',
                 'status': 'success',
                 'message': 'listening to new data',
                 'tag': self.tag,
                 'info': self._factory.info,
-                'data': [candle.model_dump() for candle in latest]
+                'seq': self._seq,
+                'data': [candle.model_dump() for candle in latest],
+                **self.degraded
             })
-        await ws.send_json({
+        await send(ws, {
             'type': 'init',
             'status': 'success',
             'message': 'listening to new data',
             'tag': self.tag,
-            'data': [candle.model_dump() for candle in latest]
+            'seq': self._seq,
+            'data': [candle.model_dump() for candle in latest],
+            **self.degraded
         })
 
+    async def add_indicators(self, ws: WebSocket, specs: list[tuple[str, type[indicators.Indicator], dict[str, int | float]]]) -> None:
+        """
+        Subscribe a listener to indicators; each distinct one is seeded from the window once and then
+        updated with every broadcast for all its listeners
+        """
+        for key, cls, params in specs:
+            series = self._indicators.get(key)
+            if series is None:
+                series = self._indicators[key] = indicators.Series(key, cls(**params), self._window, WINDOW_LIMIT)
+            series.listeners.add(ws)
+            await send(ws, {'type': 'indicator', 'tag': self.tag, 'id': key, 'params': params, 'data': series.points})
+
     async def check(self):
         """
         Check the tag is still valid
         """
         return await self._factory.check()
 
+    @tracing.traced('pull_newest')
     async def pull_newest(self):
         """
         Poll the newest data from the factory once
         """
-        return await self._factory.fetch_newest()
+        data = await self._factory.fetch_newest()
+        self._merge(data)
+        return data
+
+    def _pages(self, start: int | None, limit: int | None) -> list[tuple[int | None, int | None]]:
+        """
+        Split a history request into pages aligned to the interval grid, each no longer than one upstream
+        request returns, so overlapping requests share pages and no page is cut short upstream
+        """
+        most = self._factory.max_limit
+        # Sparse upstreams count candles that traded, not intervals: a page is not a fixed span.
+        if start is None or not limit or self._factory.SPARSE:
+            return [(start, min(limit, most) if limit and most else limit)]
+        interval = self._factory.interval_seconds
+        span = min(HISTORY_PAGE, most or HISTORY_PAGE) * interval
+        if self._factory.HISTORY_BACKWARD:
+            aligned = -(-start // span) * span
+            return [(before, span // interval) for before in range(aligned, start - limit * interval, -span)]
+        aligned = start // span * span
+        return [(after, span // interval) for after in range(aligned, start + limit * interval, span)]
+
+    def _slice(self, candles: list[datastruct.Candle], start: int | None, limit: int | None) -> list[datastruct.Candle]:
+        if start is None or not limit: return candles
+        if self._factory.SPARSE:
+            if self._factory.HISTORY_BACKWARD:
+                return [candle for candle in candles if candle.timestamp < start][-limit:]
+            return [candle for candle in candles if candle.timestamp >= start][:limit]
+        span = limit * self._factory.interval_seconds
+        lower, upper = (start - span, start) if self._factory.HISTORY_BACKWARD else (start, start + span)
+        return [candle for candle in candles if lower <= candle.timestamp < upper]
+
+    async def _fetch_page(self, key: tuple[int | None, int | None]) -> list[datastruct.Candle]:
+        try:
+            history = await self._factory.fetch_history(*key)
+            if history and self.settled(*key):
+                self._history[key] = history
+                if len(self._history) > HISTORY_CACHE_SIZE:
+                    self._history.popitem(last=False)
+            return history
+        finally:
+            del self._history_inflight[key]
+
+    async def _page(self, key: tuple[int | None, int | None]) -> list[datastruct.Candle]:
+        if key in self._history:
+            metrics.CACHE_REQUESTS.inc('history', 'hit')
+            self._history.move_to_end(key)
+            return self._history[key]
+        if key in self._history_inflight:
+            metrics.CACHE_REQUESTS.inc('history', 'shared')
+        else:
+            metrics.CACHE_REQUESTS.inc('history', 'miss')
+            self._history_inflight[key] = asyncio.ensure_future(self._fetch_page(key))
+        return await asyncio.shield(self._history_inflight[key])
+
+    async def history(self, start: str | int | None, limit: str | int | None) -> list[datastruct.Candle]:
+        """
+        Get historical data (at most HISTORY_MAX_LIMIT candles); pages of closed candles are cached and
+        identical pages in flight are shared
+        """
+        start = int(start) if start else None
+        limit = int(limit) if limit else None
+        if start is not None and start <= 0:
+            raise ValueError('Invalid start: must be positive integer')
+        if limit is not None and limit < 0:
+            raise ValueError('Invalid limit: must be positive integer or zero or none')
+        if limit:
+            limit = min(limit, HISTORY_MAX_LIMIT)
+        pages = await asyncio.gather(*[self._page(key) for key in self._pages(start, limit)])
+        if len(pages) == 1:
+            return self._slice(pages[0], start, limit)
+        candles = {candle.timestamp: candle for page in pages for candle in page}
+        return self._slice([candles[timestamp] for timestamp in sorted(candles)], start, limit)
+
+    def _fill(self, candles: list[datastruct.Candle]) -> list[datastruct.Candle]:
+        """
+        Insert candles missing from the window, and return the ones inserted
+        """
+        known = {candle.timestamp for candle in self._window}
+        added = [candle for candle in candles if candle.timestamp not in known]
+        if added:
+            self._window = sorted(self._window + added, key=lambda candle: candle.timestamp)[-WINDOW_LIMIT:]
+        return added
+
+    async def backfill(self) -> list[datastruct.Candle]:
+        """
+        Check the closed candles merged since the last check are contiguous; fill any holes with one
+        history request and send what it found to the listeners as a single `backfill` frame
+        """
+        if self._factory.SPARSE: return []
+        if self._checked is None:
+            self._checked = next((candle.timestamp for candle in reversed(self._window) if self.closed(candle)), None)
+            return []
+        interval = self._factory.interval_seconds
+        index = bisect.bisect_left(self._window, self._checked, key=lambda candle: candle.timestamp)
+        closed = [candle.timestamp for candle in self._window[index:] if self.closed(candle)]
+        if not closed: return []
+        missing: list[int] = []
+        previous: int | None = None
+        for timestamp in closed:
+            if previous is not None:
+                missing.extend(range(previous + interval, timestamp, interval))
+            previous = timestamp
+        if not missing:
+            self._checked = closed[-1]
+            return []
+        first, last = max(missing[0], missing[-1] - (HISTORY_MAX_LIMIT - 1) * interval), missing[-1]
+        limit = (last - first) // interval + 1
+        start = last + interval if self._factory.HISTORY_BACKWARD else first
+        try:
+            history = await self.history(start, limit)
+        except Exception as e:
+            metrics.BACKFILLS.inc(self._source, 'error')
+            logger.warning(f'Backfill of {self.tag} failed: {e}')
+            return []
+        self._checked = closed[-1]
+        wanted = set(missing)
+        filled = self._fill([candle for candle in history if candle.timestamp in wanted])
+        metrics.BACKFILLS.inc(self._source, 'filled' if filled else 'empty')
+        if filled:
+            await self.broadcast(filled, 'backfill')
+        return filled
 
     async def pull_history(self, ws: WebSocket, start: str | int | None, limit: str | int | None) -> None:
         """
         Get historical data based on user request
         """
+        # Someone is looking at the tag again.
+        if hasattr(self._factory, 'wake'):
+            self._factory.wake()
         try:
-            start = int(start) if start else None
-            limit = int(limit) if limit else None
-            if start is not None and start <= 0:
-                raise ValueError('Invalid start: must be positive integer')
-            if limit is not None and limit < 0:
-                raise ValueError('Invalid limit: must be positive integer or zero or none')
-            history = await self._factory.fetch_history(start, limit)
-            await ws.send_json({
+            history = await self.history(start, limit)
+            await send(ws, {
                 'type': 'history',
                 'status': 'success',
                 'message': 'fetched',
@@ -80,46 +529,116 @@ class CandleSenderReceiver:
         if ws not in self._listeners:
             raise ValueError(f'Listener not found in {self.tag} tag')
         self._listeners.remove(ws)
-        return len(self._listeners) > 0
+        for key, series in list(self._indicators.items()):
+            series.listeners.discard(ws)
+            if not series.listeners:
+                del self._indicators[key]
+        return len(self._listeners) > 0 or self._holds > 0
 
-    async def broadcast(self, data: list[datastruct.Candle]) -> None:
+    @tracing.traced('broadcast')
+    async def broadcast(self, data: list[datastruct.Candle], kind: str = 'update') -> None:
         """
-        Broadcast the newly collected data to all listeners
+        Broadcast the newly collected data to all listeners; a `backfill` inserts candles into the past,
+        so indicators are recomputed instead of stepped
         """
-        datas = [candle.model_dump() for candle in data]
-        for ws in self._listeners:
-            try:
-                await ws.send_json({
-                    'type': 'update',
-                    'data': datas
-                })
-            except Exception: pass
+        for sink in self._sinks:
+            sink(data)
+        if not self._listeners:
+            return self._forget()
+        started = time.perf_counter()
+        with tracing.span('serialize'):
+            payload = self._sequence({
+                'type': kind,
+                'data': [candle.model_dump() for candle in data],
+                **self.degraded
+            })
+        sent = 0
+        with tracing.span('send', listeners=len(self._listeners)):
+            for ws in tuple(self._listeners):
+                try:
+                    await ws.send_text(payload)
+                    sent += 1
+                except Exception: pass
+        metrics.BYTES_SENT.inc(kind, value=len(payload) * sent)
+        for series in tuple(self._indicators.values()):
+            with tracing.span('indicator', id=series.key):
+                points = series.reseed(self._window, data[0].timestamp) if kind == 'backfill' else series.update(data)
+                if not points: continue
+                payload = dumps({'type': 'indicator', 'tag': self.tag, 'id': series.key, 'data': points})
+                sent = 0
+                for ws in tuple(series.listeners):
+                    try:
+                        await ws.send_text(payload)
+                        sent += 1
+                    except Exception: pass
+                metrics.BYTES_SENT.inc('indicator', value=len(payload) * sent)
+        elapsed = time.perf_counter() - started
+        metrics.FANOUT.observe(elapsed, self._source)
+        metrics.FANOUT_LAST.set(elapsed, self.tag)
 
 
 class CandleManager:
     listeners: dict[str, CandleSenderReceiver] = {}
+    subscriptions: dict[WebSocket, set[str]] = {}
+    readers: OrderedDict[str, CandleSenderReceiver] = OrderedDict()
+    history_buckets: dict[WebSocket, TokenBucket] = {}
+    budgets: dict[str, TokenBucket] = {}
+    rotations: dict[str, int] = {}
+    # Keyed by upstream budget; (source, None) when the ingest process decides admission.
+    queued: dict[tuple[str, float | None], deque[tuple[WebSocket, str, list]]] = {}
+    idle: OrderedDict[str, tuple[CandleSenderReceiver, float]] = OrderedDict()
+    idle_bytes = 0
+
+    @classmethod
+    async def _listen(cls, ws: WebSocket, tag: str, specs: list | None = None, resume: int | None = None) -> None:
+        subscribed = cls.subscriptions.get(ws, set())
+        if tag not in subscribed and len(subscribed) >= MAX_SUBSCRIPTIONS:
+            raise ValueError(f'Too many subscriptions: at most {MAX_SUBSCRIPTIONS} per connection')
+        tag = await cls._subscribe(ws, tag, specs, resume)
+        if tag is not None:
+            cls.subscriptions.setdefault(ws, set()).add(tag)
+            if specs:
+                await cls.listeners[tag].add_indicators(ws, specs)
 
     @classmethod
-    async def _listen(cls, ws: WebSocket, tag: str) -> None:
+    async def resolve(cls, tag: str) -> tuple[str, CandleSenderReceiver] | None:
+        """
+        Find or create the sender/receiver of a tag without registering it, and return it with the resolved tag
+        """
+        if tag in cls.idle:
+            return tag, cls._revive(tag)
         mode, args = tag.split(':', 1)
         match mode:
             case 'dex':
                 if tag in cls.listeners:
-                    return await cls.listeners[tag].add_listener(ws)
+                    return tag, cls.listeners[tag]
                 if datastruct.dex_cls is None:
                     raise ValueError('DEX Candle Factory not set.')
                 csr = CandleSenderReceiver(tag, datastruct.dex_cls(*args.split(':')))
                 if not await csr.check():
                     raise ValueError('Invalid DEX Candle Factory')
-                await csr.add_listener(ws)
-                cls.listeners[tag] = csr
-                logger.info(f'New Listener for {tag}')
+                return tag, csr
+            case 'stream':
+                if tag in cls.listeners:
+                    return tag, cls.listeners[tag]
+                if datastruct.stream_cls is None:
+                    raise ValueError('Stream Candle Factory not set.')
+                csr = CandleSenderReceiver(tag, datastruct.stream_cls(*args.split(':')))
+                if not await csr.check():
+                    raise ValueError('Invalid Stream Candle Factory')
+                return tag, csr
             case 'cex':
                 if tag in cls.listeners:
-                    return await cls.listeners[tag].add_listener(ws)
+                    return tag, cls.listeners[tag]
                 if datastruct.cex_cls is None:
                     raise ValueError('CEX Candle Factory not set.')
-                if '*' in args:
+                if args.startswith('index:'):
+                    csr = CandleSenderReceiver(tag, IndexFactory(cls, *args.split(':')[1:]))
+                    if not await csr.check():
+                        raise ValueError('No CEX can fetch the data')
+                    return tag, csr
+                wildcard = '*' in args
+                if wildcard:
                     if getattr(datastruct.cex_cls, 'check_first_cex', None) is None:
                         raise ValueError('CEX Candle Factory not support wildcard')
                     cex: str | None = await datastruct.cex_cls.check_first_cex(*args.split(':'))
@@ -128,25 +647,204 @@ class CandleManager:
                     args = args.replace('*', cex, 1)
                     tag = f'cex:{args}'
                 if tag in cls.listeners:
-                    return await cls.listeners[tag].add_listener(ws)
-                csr = CandleSenderReceiver(tag, datastruct.cex_cls(*args.split(':')))
+                    return tag, cls.listeners[tag]
+                if tag in cls.idle:
+                    return tag, cls._revive(tag)
+                factory = datastruct.cex_cls(*args.split(':'))
+                if wildcard and hasattr(factory, 'enable_failover'):
+                    factory.enable_failover()
+                csr = CandleSenderReceiver(tag, factory)
                 if not await csr.check():
                     raise ValueError('Invalid CEX Candle Factory')
-                await csr.add_listener(ws)
-                cls.listeners[tag] = csr
-                logger.info(f'New Listener for {tag}')
+                return tag, csr
             case _:
-                await ws.send_json({'type': 'error', 'message': f'Invalid Tag {tag}'})
+                return None
+
+    @classmethod
+    async def _subscribe(cls, ws: WebSocket, tag: str, specs: list | None = None, resume: int | None = None) -> str | None:
+        """
+        Add the socket to the tag's listeners, and return the resolved tag
+        """
+        csr = cls.readers.pop(tag, None) or (cls._revive(tag) if tag in cls.idle else None)
+        resolved = (csr.tag, csr) if csr is not None else await cls.resolve(tag)
+        if resolved is None:
+            await ws.send_json({'type': 'error', 'message': f'Invalid Tag {tag}'})
+            return None
+        tag, csr = resolved
+        if tag not in cls.listeners and not await cls._admit(ws, tag, csr, specs):
+            return None
+        await csr.add_listener(ws, resume)
+        if tag not in cls.listeners:
+            cls.listeners[tag] = csr
+            csr.start_stream()
+            logger.info(f'New Listener for {tag}')
+        return tag
+
+    @classmethod
+    def _polled(cls, budget: tuple[str, float]) -> int:
+        return sum(
+            1 for csr in cls.listeners.values()
+            if not csr.streaming and getattr(csr.factory, 'rate_budget', None) == budget
+        )
+
+    @classmethod
+    def admission(cls, csr: CandleSenderReceiver) -> str:
+        """
+        Whether a new tag may be polled (`admitted`): past SCHEDULE_MAX_CADENCE times its upstream's
+        capacity, it is `queued` until a tag of that upstream goes away, or `rejected`, as ADMISSION_POLICY
+        says; factories polled elsewhere (the ingest process) carry the decision made there
+        """
+        budget = getattr(csr.factory, 'rate_budget', None)
+        if budget is None or csr.streaming:
+            return getattr(csr.factory, 'admission', 'admitted')
+        if ADMISSION_POLICY == 'admit' or cls._polled(budget) < capacity(budget[1]) * SCHEDULE_MAX_CADENCE:
+            return 'admitted'
+        return 'queued' if ADMISSION_POLICY == 'queue' else 'rejected'
+
+    @classmethod
+    async def _admit(cls, ws: WebSocket, tag: str, csr: CandleSenderReceiver, specs: list | None) -> bool:
+        """
+        Apply the admission of a new tag to a listen: go on, queue it or reject it
+        """
+        admission = cls.admission(csr)
+        budget = getattr(csr.factory, 'rate_budget', None) or (csr.source, None)
+        source = budget[0]
+        if admission == 'admitted':
+            metrics.ADMISSIONS.inc(source, 'admitted')
+            return True
+        cls._close(csr)
+        queue = cls.queued.setdefault(budget, deque())
+        if admission == 'queued' and len(queue) < ADMISSION_QUEUE_SIZE:
+            if not any(entry[:2] == (ws, tag) for entry in queue):
+                queue.append((ws, tag, specs or []))
+            metrics.ADMISSIONS.inc(source, 'queued')
+            await send(ws, {
+                'type': 'init',
+                'status': 'queued',
+                'message': f'{source} is at capacity, listening as soon as it frees up',
+                'tag': tag,
+                'position': next(index for index, entry in enumerate(queue, 1) if entry[:2] == (ws, tag)),
+                'data': []
+            })
+            return False
+        metrics.ADMISSIONS.inc(source, 'rejected')
+        await send(ws, {'type': 'init', 'status': 'error', 'message': f'{source} is at capacity, retry later', 'tag': tag, 'data': []})
+        return False
+
+    @classmethod
+    async def _listen_queued(cls, ws: WebSocket, tag: str, specs: list) -> None:
+        try:
+            await cls._listen(ws, tag, specs)
+        except (ValueError, LookupError) as e:
+            await ws.send_json({'type': 'init', 'status': 'error', 'message': str(e), 'tag': tag, 'data': []})
+        except Exception as e:
+            logger.warning(f'Error while admitting {tag}: {e}')
+
+    @classmethod
+    def _dequeue(cls) -> None:
+        """
+        Listen queued tags again as far as their upstream has room; when the ingest process decides,
+        every queued listen asks it again
+        """
+        for budget, queue in cls.queued.items():
+            if budget[1] is None:
+                room = len(queue)
+            else:
+                room = capacity(budget[1]) * SCHEDULE_MAX_CADENCE - cls._polled(budget)
+            while queue and room > 0:
+                room -= 1
+                asyncio.create_task(cls._listen_queued(*queue.popleft()), name=f'Admit:{budget[0]}')
+
+    @classmethod
+    async def reader(cls, tag: str) -> CandleSenderReceiver:
+        """
+        The sender/receiver serving one-shot reads of a tag: the live one when the tag is listened,
+        otherwise one kept in a small LRU so repeated reads share its caches
+        """
+        if tag in cls.listeners:
+            return cls.listeners[tag]
+        if tag in cls.readers:
+            cls.readers.move_to_end(tag)
+            return cls.readers[tag]
+        if tag.split(':', 1)[0] == 'stream':
+            # Reading a trade stream once would open an upstream connection the LRU keeps open.
+            raise ValueError(f'{tag} is only served to listeners')
+        resolved = await cls.resolve(tag)
+        if resolved is None:
+            raise ValueError(f'Invalid Tag {tag}')
+        resolved_tag, csr = resolved
+        if resolved_tag in cls.listeners:
+            return csr
+        cls.readers[tag] = csr
+        if len(cls.readers) > READER_CACHE_SIZE:
+            cls._close(cls.readers.popitem(last=False)[1])
+        return csr
 
     @classmethod
     async def _unlisten(cls, ws: WebSocket, tag: str) -> None:
         if tag not in cls.listeners:
             return await ws.send_json({'type': 'notice', 'status': 'error', 'message': f'No listener for {tag}'})
         if not cls.listeners[tag].remove_listener(ws):
-            del cls.listeners[tag]
-            logger.info(f'Listener for {tag} removed')
+            cls._linger(tag)
+        cls.subscriptions.get(ws, set()).discard(tag)
         await ws.send_json({'type': 'notice', 'status': 'success', 'message': 'unlisten success', 'tag': tag})
 
+    @classmethod
+    def _drop(cls, tag: str) -> None:
+        cls._close(cls.listeners.pop(tag))
+        metrics.FANOUT_LAST.remove(tag)
+        logger.info(f'Listener for {tag} removed')
+
+    @classmethod
+    def _linger(cls, tag: str) -> None:
+        """
+        Park a tag whose last listener left: it is no longer polled, but its caches survive for
+        LINGER_SECONDS so a listener coming back gets it without any upstream call; the least recently
+        parked tags are evicted first once the parked windows exceed LINGER_BUDGET bytes
+        """
+        if LINGER_SECONDS <= 0:
+            return cls._drop(tag)
+        csr = cls.listeners.pop(tag)
+        csr.stop_stream()
+        metrics.FANOUT_LAST.remove(tag)
+        cls.idle[tag] = (csr, time.time() + LINGER_SECONDS)
+        cls.idle_bytes += csr.footprint()
+        while cls.idle_bytes > LINGER_BUDGET and cls.idle:
+            cls._evict(next(iter(cls.idle)))
+
+    @classmethod
+    def _revive(cls, tag: str) -> CandleSenderReceiver:
+        csr, _ = cls.idle.pop(tag)
+        cls.idle_bytes -= csr.footprint()
+        metrics.CACHE_REQUESTS.inc('linger', 'hit')
+        # Serve the parked window as is; the cursor of the next poll fetches whatever was missed.
+        csr.touch()
+        return csr
+
+    @classmethod
+    def _evict(cls, tag: str) -> None:
+        csr, _ = cls.idle.pop(tag)
+        cls.idle_bytes -= csr.footprint()
+        cls._close(csr)
+        logger.info(f'Listener for {tag} removed')
+
+    @classmethod
+    def _sweep(cls) -> None:
+        now = time.time()
+        for tag, (_, deadline) in list(cls.idle.items()):
+            if deadline <= now:
+                cls._evict(tag)
+
+    @staticmethod
+    def _close(csr: CandleSenderReceiver) -> None:
+        """
+        Let a factory holding outside resources (see candle.remote, candle.stream) release them
+        """
+        csr.stop_stream()
+        close = getattr(csr.factory, 'close', None)
+        if close is not None:
+            close()
+
     @staticmethod
     def get_tag(data: dict[str, str]):
         tag = data.get('tag', '')
@@ -161,11 +859,111 @@ class CandleManager:
             raise ValueError('Invalid Tag')
         return tag
 
+    @classmethod
+    async def _deliver(cls, tag: str, csr: CandleSenderReceiver, boundary: float) -> None:
+        if cls.listeners.get(tag) is not csr: return
+        with tracing.span('tag', tag=tag):
+            try:
+                data = await csr.pull_newest()
+                if not data: return
+                await csr.broadcast(data)
+            except Exception as e:
+                return logger.warning(f'Error while polling {tag}: {e}')
+        metrics.DELIVERY_DELAY.observe(time.time() - boundary, csr.source)
+        with tracing.span('backfill', tag=tag):
+            await csr.backfill()
+
+    @classmethod
+    async def _paced(cls, budget: tuple[str, float] | None, tags: list[tuple[str, CandleSenderReceiver]], boundary: float) -> None:
+        """
+        Poll the tags of one upstream, busiest first, spread over the schedule window without
+        exceeding its rate budget
+        """
+        if budget is None:
+            # Nothing upstream to protect (e.g. read from the ingest process).
+            await asyncio.gather(*[cls._deliver(tag, csr, boundary) for tag, csr in tags])
+            return
+        source, rate = budget
+        bucket = cls.budgets.get(source)
+        if bucket is None:
+            bucket = cls.budgets[source] = TokenBucket(rate, max(1.0, rate))
+        spacing = max(1 / rate, SCHEDULE_WINDOW / len(tags))
+        tasks: list[asyncio.Task[None]] = []
+        for index, (tag, csr) in enumerate(tags):
+            at = boundary + (index + random.random() * SCHEDULE_JITTER) * spacing
+            await asyncio.sleep(max(0.0, at - time.time()))
+            wait = bucket.wait_time()
+            if wait > 0:
+                metrics.UPSTREAM_RATE_LIMIT_WAIT.observe(wait, source)
+                await asyncio.sleep(wait)
+            bucket.take()
+            tasks.append(asyncio.create_task(cls._deliver(tag, csr, boundary)))
+        await asyncio.gather(*tasks)
+
+    @classmethod
+    def _ration(cls, budget: tuple[str, float], tags: list[tuple[str, CandleSenderReceiver]]) -> list[tuple[str, CandleSenderReceiver]]:
+        """
+        The tags of one upstream to poll this period, out of all of them ranked by priority: as many as
+        its capacity allows every period, and the others in turn with the polls left
+        """
+        source, rate = budget
+        limit = capacity(rate)
+        full = full_cadence(limit, len(tags))
+        for _, csr in tags[:full]:
+            csr.cadence = 1
+        rest = tags[full:]
+        metrics.DEGRADED_TAGS.set(len(rest), source)
+        if not rest: return tags
+        slots = min(len(rest), limit - full)
+        cadence = -(-len(rest) // slots)
+        for _, csr in rest:
+            csr.cadence = cadence
+        offset = cls.rotations.get(source, 0) % len(rest)
+        cls.rotations[source] = offset + slots
+        return tags[:full] + (rest + rest)[offset:offset + slots]
+
     @classmethod
     async def broadcast(cls) -> None:
-        for tag, candler in cls.listeners.copy().items():
-            data = await candler.pull_newest()
-            await candler.broadcast(data)
+        """
+        Poll and broadcast every tag once; each upstream gets its requests spread over the first
+        SCHEDULE_WINDOW seconds after the candle boundary instead of all at once
+        """
+        cls._sweep()
+        boundary = time.time() // BROADCAST_PERIOD * BROADCAST_PERIOD
+        groups: dict[tuple[str, float] | None, list[tuple[str, CandleSenderReceiver]]] = {}
+        for tag, csr in cls.listeners.items():
+            if csr.streaming: continue
+            if not csr.due():
+                metrics.POLLS_SKIPPED.inc(csr.source)
+                continue
+            groups.setdefault(getattr(csr.factory, 'rate_budget', None), []).append((tag, csr))
+        cls._dequeue()
+        for budget, tags in groups.items():
+            # Most listened first, then the shortest intervals, whose candles change the most.
+            tags.sort(key=lambda item: (-item[1].demand, item[1].factory.interval_seconds))
+            if budget is not None:
+                groups[budget] = cls._ration(budget, tags)
+        with tracing.trace('cycle', tags=len(cls.listeners)):
+            await asyncio.gather(*[cls._paced(budget, tags, boundary) for budget, tags in groups.items()])
+
+    @classmethod
+    async def run(cls) -> None:
+        """
+        Broadcast once per BROADCAST_PERIOD, aligned to the period boundaries
+        """
+        while True:
+            ts = time.time()
+            metrics.BROADCAST_LAG.observe(ts % BROADCAST_PERIOD)
+            try:
+                await cls.broadcast()
+            except Exception as e:
+                logger.exception(f"Error while broadcasting: {e}")
+            now = time.time()
+            metrics.BROADCAST_CYCLE.observe(now - ts)
+            if profiler.active:
+                profiler.cycle_done()
+            if now - ts < BROADCAST_PERIOD:
+                await asyncio.sleep(BROADCAST_PERIOD - now % BROADCAST_PERIOD)
 
     @classmethod
     async def message_handle(cls, ws: WebSocket, message: dict[str, str]) -> None:
@@ -175,7 +973,11 @@ class CandleManager:
             case 'listen':
                 try:
                     tag = cls.get_tag(data)
-                    await cls._listen(ws, tag)
+                    specs = indicators.parse(data.get('indicators', []))
+                    resume = data.get('resume')
+                    if resume is not None and (isinstance(resume, bool) or not isinstance(resume, int)):
+                        raise ValueError('Invalid resume: must be the seq of the last frame received')
+                    await cls._listen(ws, tag, specs, resume)
                 except (ValueError, LookupError) as e:
                     return await ws.send_json({'type': 'init', 'status': 'error', 'message': str(e), 'data': []})
             case 'unlisten':
@@ -191,11 +993,35 @@ class CandleManager:
                     return await ws.send_json({'type': 'history', 'status': 'error', 'message': str(e), 'data': []})
                 if tag not in cls.listeners:
                     return await ws.send_json({'type': 'error', 'message': f'No listener for {tag}'})
+                bucket = cls.history_buckets.get(ws)
+                if bucket is None:
+                    bucket = cls.history_buckets[ws] = TokenBucket(HISTORY_RATE, HISTORY_BURST)
+                if not bucket.take():
+                    retry_after = round(bucket.wait_time(), 1)
+                    return await ws.send_json({
+                        'type': 'history',
+                        'status': 'error',
+                        'message': f'Too many history requests, retry in {retry_after}s',
+                        'retry_after': retry_after,
+                        'data': []
+                    })
                 await cls.listeners[tag].pull_history(ws, data['start'], data.get('limit'))
 
     @classmethod
     async def disconnect(cls, ws: WebSocket) -> None:
-        for tag in list(cls.listeners):
-            if not cls.listeners[tag].remove_listener(ws):
-                del cls.listeners[tag]
-                logger.info(f'Listener for {tag} removed')
+        cls.history_buckets.pop(ws, None)
+        for budget, queue in cls.queued.items():
+            cls.queued[budget] = deque(entry for entry in queue if entry[0] is not ws)
+        for tag in cls.subscriptions.pop(ws, ()):
+            csr = cls.listeners.get(tag)
+            if csr is None: continue
+            try:
+                if not csr.remove_listener(ws):
+                    cls._linger(tag)
+            except ValueError: continue
+
+
+metrics.ACTIVE_TAGS.set_function(lambda: len(CandleManager.listeners))
+metrics.IDLE_TAGS.set_function(lambda: len(CandleManager.idle))
+metrics.IDLE_BYTES.set_function(lambda: CandleManager.idle_bytes)
+metrics.ACTIVE_LISTENERS.set_function(lambda: sum(csr.listener_count for csr in CandleManager.listeners.values()))
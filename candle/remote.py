@@ -0,0 +1,287 @@
+from typing import Any, AsyncIterator
+from . import datastruct as ds
+from .shm import CandleRing, INGEST_SOCKET
+from .stream import STREAM_PUSH_INTERVAL
+from utils.logger import logger
+import json as jsonlib
+import itertools
+import asyncio
+import os
+
+
+# `standalone` polls upstream in this process, `web` reads what `python -m candle.ingest` publishes.
+ROLE = os.getenv('CANDLE_ROLE', 'standalone')
+# Seconds between two attempts to acquire a listened tag while the ingest process is unavailable.
+INGEST_RETRY = float(os.getenv('INGEST_RETRY', 1))
+
+
+class IngestClient:
+    """
+    Request/response over the ingest control socket, one connection per worker.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._ids = itertools.count()
+        self._pending: dict[int, asyncio.Future[dict[str, Any]]] = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._connecting = asyncio.Lock()
+        # Bumped whenever the connection drops: the ingest process released whatever it held for us.
+        self.epoch = 0
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connecting:
+            if self._writer is None or self._writer.is_closing():
+                try:
+                    reader, self._writer = await asyncio.open_unix_connection(self._path)
+                except OSError as e:
+                    raise ds.UpstreamConnectError(f'Ingest process unavailable: {e}') from e
+                asyncio.create_task(self._read(reader, self._writer), name='IngestReader')
+            return self._writer
+
+    async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                response = jsonlib.loads(line)
+                future = self._pending.pop(response.pop('id', None), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f'Ingest connection failed: {e}')
+        finally:
+            writer.close()
+            self.epoch += 1
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ds.UpstreamConnectError('Ingest process went away'))
+            self._pending.clear()
+
+    async def request(self, op: str, **params: Any) -> dict[str, Any]:
+        writer = await self._connect()
+        request_id = next(self._ids)
+        future = self._pending[request_id] = asyncio.get_running_loop().create_future()
+        writer.write(jsonlib.dumps({'id': request_id, 'op': op, **params}).encode() + b'\n')
+        try:
+            response = await future
+        finally:
+            self._pending.pop(request_id, None)
+        if response.get('status') != 'success':
+            raise LookupError(response.get('message', 'Ingest error'))
+        return response
+
+
+client = IngestClient(INGEST_SOCKET)
+
+# Factories listened in this worker, and the one task waking them when the ingest process writes their ring.
+attached: set['RemoteFactory'] = set()
+watcher: asyncio.Task[None] | None = None
+
+
+async def watch() -> None:
+    """
+    Every STREAM_PUSH_INTERVAL, wake the attached factories whose ring changed or whose hold was lost
+    with the connection, until none is attached
+    """
+    while attached:
+        for factory in attached:
+            if factory._epoch != client.epoch or factory._ring is not None and factory._ring.seq != factory._seq:
+                factory._changed.set()
+        await asyncio.sleep(STREAM_PUSH_INTERVAL)
+
+
+class RemoteFactory:
+    """
+    Candles published by the ingest process: the window is read from its shared memory ring,
+    history is asked over the control socket. Updates are pushed (`updates`) as the ring changes,
+    whatever the ingest process polls or streams.
+    """
+    _tag: str
+    _failover = False
+    _ring: CandleRing | None = None
+    _seq = 0
+    _head = 0
+    # Connection epoch the tag was acquired on, None while not held.
+    _epoch: int | None = None
+    _info: dict[str, Any] | None = None
+    admission = 'admitted'
+
+    async def check(self) -> bool:
+        """
+        Resolve the tag in the ingest process, without holding it: one-shot reads go through the
+        control socket, and only listening (`updates`) holds the tag and maps its ring
+        """
+        try:
+            response = await client.request('check', tag=self._tag, failover=self._failover)
+        except ds.UpstreamError: raise
+        except LookupError as e:
+            logger.warning(f'Cannot check {self._tag}: {e}')
+            return False
+        self._tag = response['tag']
+        # What a listen would get now: the manager queues or rejects it otherwise.
+        self.admission = response['admission']
+        self._info = response.get('info')
+        return True
+
+    @property
+    def cadence(self) -> int:
+        """
+        Periods between two polls of the tag in the ingest process
+        """
+        return self._ring.cadence if self._ring is not None else 1
+
+    async def _attach(self) -> bool:
+        """
+        Hold the tag in the ingest process and map its ring; when acquired again after the connection
+        dropped, keep the mapping unless the ingest process restarted with a new ring
+        """
+        epoch = client.epoch
+        acquiring = asyncio.ensure_future(client.request('acquire', tag=self._tag, failover=self._failover))
+
+        def give_back(task: asyncio.Future[dict[str, Any]]) -> None:
+            if not task.cancelled() and task.exception() is None and 'shm' in task.result():
+                self._release()
+
+        try:
+            response = await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Stopped while acquiring: release the hold once it is granted.
+            acquiring.add_done_callback(give_back)
+            raise
+        except LookupError as e:
+            logger.warning(f'Cannot acquire {self._tag}: {e}')
+            return False
+        if 'shm' not in response:
+            logger.warning(f'Cannot acquire {self._tag}: {response.get("admission")}')
+            return False
+        self._epoch = epoch
+        ring = self._ring
+        if ring is not None and ring.name == response['shm'] and ring.generation == response['generation']:
+            return True
+        if ring is not None:
+            logger.info(f'Ingest process restarted, mapping the new ring of {self._tag}')
+            ring.close()
+            # Read the whole new ring; updates skips what was already sent.
+            self._ring = CandleRing.attach(response['shm'])
+            self._seq, self._head = -1, 0
+            return True
+        self._ring = CandleRing.attach(response['shm'])
+        self._seq, self._head = self._ring.seq, self._ring.head
+        return True
+
+    def _send(self, op: str) -> None:
+        """
+        Send a request about the tag without waiting for the answer
+        """
+        task = asyncio.ensure_future(client.request(op, tag=self._tag))
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def _release(self) -> None:
+        self._send('release')
+
+    def _detach(self) -> None:
+        attached.discard(self)
+        if self._ring is None: return
+        self._ring.close()
+        self._ring = None
+        # After the connection dropped there is no hold left to release.
+        if self._epoch == client.epoch:
+            self._release()
+        self._epoch = None
+
+    def close(self) -> None:
+        self._detach()
+
+    async def fetch_latest(self) -> list[ds.Candle]:
+        if self._ring is None:
+            response = await client.request('latest', tag=self._tag)
+            return [ds.Candle(**row) for row in response['data']]
+        # Leave the sequence number to `updates`, which broadcasts the change.
+        _, candles = self._ring.read()
+        return candles
+
+    async def fetch_newest(self) -> list[ds.Candle]:
+        return (await self.fetch_latest())[-3:]
+
+    async def updates(self) -> AsyncIterator[list[ds.Candle]]:
+        """
+        Hold the tag while listened, and yield the candles the ingest process wrote since the last
+        update, once the watcher saw the ring change. When the control connection drops (the ingest
+        process released the tag, or restarted), acquire it again every INGEST_RETRY until it is back.
+        """
+        global watcher
+        self._changed = asyncio.Event()
+        since: int | None = None
+        try:
+            while True:
+                if self._epoch != client.epoch and not await self._attach():
+                    await asyncio.sleep(INGEST_RETRY)
+                    continue
+                attached.add(self)
+                if watcher is None or watcher.done():
+                    watcher = asyncio.create_task(watch(), name='IngestWatcher')
+                await self._changed.wait()
+                self._changed.clear()
+                if self._ring is None or self._ring.seq == self._seq: continue
+                # The last candle may be updated in place: read it again along with the appended ones.
+                head = self._ring.head
+                self._seq, candles = self._ring.read(head - self._head + 1)
+                self._head = head
+                candles = [candle for candle in candles if since is None or candle.timestamp >= since]
+                if candles:
+                    since = candles[-1].timestamp
+                    yield candles
+        finally:
+            # Parked or dropped: a tag nobody listens to is not held.
+            self._detach()
+
+    async def fetch_history(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
+        response = await client.request('history', tag=self._tag, start=start, limit=limit)
+        return [ds.Candle(**row) for row in response['data']]
+
+
+class RemoteCex(RemoteFactory, ds.CexCandleFactory):
+    @classmethod
+    async def check_first_cex(cls, *args: str) -> str | None:
+        return (await client.request('first_cex', args=list(args)))['exchange']
+
+    def __init__(self, exchange: str, symbol: str, interval: str | None = None) -> None:
+        super().__init__(exchange, symbol, interval)
+        self._tag = ':'.join(['cex', exchange, symbol] + ([interval] if interval else []))
+
+    def enable_failover(self) -> None:
+        self._failover = True
+
+
+class RemoteDex(RemoteFactory, ds.DexCandleFactory):
+    HISTORY_BACKWARD = True
+    SPARSE = True
+
+    def __init__(self, chain: str, address: str, pool: str | None = None, interval: str | None = None) -> None:
+        super().__init__(chain, address, pool, interval)
+        self._tag = ':'.join(['dex', chain, address, self.pool] + ([interval] if interval else []))
+
+    @property
+    def info(self) -> dict[str, Any]:
+        return self._info or {'token': self.address, 'base': None, 'quote': None}
+
+    def wake(self) -> None:
+        """
+        Someone asked for history: have the ingest process poll the pool every period again
+        """
+        self._send('wake')
+
+
+class RemoteStream(RemoteFactory, ds.StreamCandleFactory):
+    """
+    Trade stream candles built by the ingest process, so workers do not each open the upstream stream.
+    """
+    SPARSE = True
+
+    def __init__(self, exchange: str, symbol: str, interval: str | None = None) -> None:
+        super().__init__(exchange, symbol, interval)
+        self._tag = ':'.join(['stream', exchange, symbol] + ([interval] if interval else []))
+
+
+def init():
+    ds.register(RemoteCex)
+    ds.register(RemoteDex)
+    ds.register(RemoteStream)
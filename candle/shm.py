@@ -0,0 +1,144 @@
+from multiprocessing import resource_tracker, shared_memory
+from . import datastruct as ds
+import hashlib
+import struct
+import time
+import os
+
+
+SHM_SLOTS = int(os.getenv('SHM_SLOTS', 1024))
+# Control channel between the ingest process and the web workers.
+INGEST_SOCKET = os.getenv('INGEST_SOCKET', '/tmp/satoshi-candle-ingest.sock')
+
+# seq (odd while a write is in progress), head (candles ever written), capacity, cadence (periods
+# between two polls of the tag, see CandleManager._ration), generation (the ingest run that created the ring)
+HEADER = struct.Struct('<QQQQQ')
+CADENCE = struct.Struct('<Q')
+CADENCE_OFFSET = 24
+GENERATION = struct.Struct('<Q')
+GENERATION_OFFSET = 32
+# timestamp, open, high, low, close, volume
+SLOT = struct.Struct('<qddddd')
+
+
+def shm_name(tag: str) -> str:
+    return 'candle-' + hashlib.sha1(tag.encode()).hexdigest()[:20]
+
+
+class CandleRing:
+    """
+    Ring of candles in shared memory with a single writer (the ingest process) and any number of readers.
+
+    The writer bumps the sequence counter to an odd value before touching the slots and to the next
+    even value afterwards; readers decode straight from the mapping and retry when the counter moved
+    or was odd meanwhile, so neither side ever takes a lock.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        self._shm = shm
+        self._buf = shm.buf
+        self._owner = owner
+        self.capacity = HEADER.unpack_from(self._buf, 0)[2]
+
+    @classmethod
+    def create(cls, tag: str, capacity: int = SHM_SLOTS, generation: int = 0) -> 'CandleRing':
+        name = shm_name(tag)
+        try:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError: pass
+        shm = shared_memory.SharedMemory(name, create=True, size=HEADER.size + SLOT.size * capacity)
+        HEADER.pack_into(shm.buf, 0, 0, 0, capacity, 1, generation)
+        return cls(shm, True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'CandleRing':
+        shm = shared_memory.SharedMemory(name)
+        # Readers must not unlink the segment when they exit, the ingest process owns it.
+        resource_tracker.unregister(shm._name, 'shared_memory')  # type: ignore[attr-defined]
+        return cls(shm, False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def seq(self) -> int:
+        return HEADER.unpack_from(self._buf, 0)[0]
+
+    @property
+    def head(self) -> int:
+        return HEADER.unpack_from(self._buf, 0)[1]
+
+    @property
+    def cadence(self) -> int:
+        return CADENCE.unpack_from(self._buf, CADENCE_OFFSET)[0]
+
+    @cadence.setter
+    def cadence(self, value: int) -> None:
+        CADENCE.pack_into(self._buf, CADENCE_OFFSET, value)
+
+    @property
+    def generation(self) -> int:
+        """
+        Identifies the ingest run that created the ring: a restarted ingest process creates the ring
+        again under the same name, while a reader may still map the old one.
+        """
+        return GENERATION.unpack_from(self._buf, GENERATION_OFFSET)[0]
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + SLOT.size * (index % self.capacity)
+
+    def write(self, candles: list[ds.Candle]) -> None:
+        """
+        Append newer candles and overwrite the last one when it is updated again; older candles (a
+        backfill) are merged in by rewriting the slots in order.
+        """
+        if not candles: return
+        seq, head, capacity, *rest = HEADER.unpack_from(self._buf, 0)
+        last = SLOT.unpack_from(self._buf, self._offset(head - 1))[0] if head else None
+        HEADER.pack_into(self._buf, 0, seq + 1, head, capacity, *rest)
+        if last is not None and candles[0].timestamp < last:
+            size = min(head, capacity)
+            rows = {row[0]: row for row in (SLOT.unpack_from(self._buf, self._offset(index)) for index in range(head - size, head))}
+            rows.update((c.timestamp, (c.timestamp, c.open, c.high, c.low, c.close, c.volume)) for c in candles)
+            ordered = sorted(rows.values())[-capacity:]
+            head += len(ordered) - size
+            for index, row in enumerate(ordered, head - len(ordered)):
+                SLOT.pack_into(self._buf, self._offset(index), *row)
+            HEADER.pack_into(self._buf, 0, seq + 2, head, capacity, *rest)
+            return
+        for candle in candles:
+            if last is not None and candle.timestamp < last: continue
+            if last is not None and candle.timestamp == last:
+                index = head - 1
+            else:
+                index = head
+                head += 1
+            SLOT.pack_into(self._buf, self._offset(index), candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+            last = candle.timestamp
+        HEADER.pack_into(self._buf, 0, seq + 2, head, capacity, *rest)
+
+    def read(self, count: int | None = None) -> tuple[int, list[ds.Candle]]:
+        """
+        Return the sequence number and the newest `count` candles (all by default), oldest first.
+        """
+        while True:
+            seq, head, capacity, *_ = HEADER.unpack_from(self._buf, 0)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            size = min(head, capacity if count is None else min(count, capacity))
+            rows = [SLOT.unpack_from(self._buf, self._offset(index)) for index in range(head - size, head)]
+            if HEADER.unpack_from(self._buf, 0)[0] == seq:
+                return seq, [
+                    ds.Candle(timestamp=ts, open=o, high=h, low=l, close=c, volume=v)
+                    for ts, o, h, l, c, v in rows
+                ]
+
+    def close(self) -> None:
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            try: self._shm.unlink()
+            except FileNotFoundError: pass
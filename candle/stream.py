@@ -0,0 +1,282 @@
+from typing import Any, AsyncIterator
+from array import array
+from . import cex_impl, datastruct as ds
+from utils.logger import logger
+from utils import metrics
+import json as jsonlib
+import asyncio
+import os
+
+
+STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 3600))
+STREAM_PUSH_INTERVAL = float(os.getenv('STREAM_PUSH_INTERVAL', 0.25))
+STREAM_RECONNECT_DELAY = float(os.getenv('STREAM_RECONNECT_DELAY', 1))
+STREAM_INTERVALS = {'1s': 1, '5s': 5, '15s': 15, '1m': 60}
+
+
+class CandleBuffer:
+    """
+    Ring of the last `size` candles of one interval, kept in flat arrays instead of one object per candle.
+    """
+    def __init__(self, interval: int, size: int = STREAM_BUFFER_SIZE) -> None:
+        self.interval = interval
+        self.size = size
+        self.version = 0
+        self._count = 0
+        self._ts = array('q', bytes(8 * size))
+        self._ohlcv = array('d', bytes(8 * 5 * size))
+
+    def __len__(self) -> int:
+        return min(self._count, self.size)
+
+    def _find(self, bucket: int) -> int | None:
+        # Trades arrive (nearly) in order, a late one belongs to one of the last few candles at most.
+        for index in range(self._count - 1, max(-1, self._count - 1 - min(4, self.size)), -1):
+            ts = self._ts[index % self.size]
+            if ts == bucket: return index
+            if ts < bucket: return None
+        return None
+
+    def add(self, ts: float, price: float, qty: float) -> None:
+        bucket = int(ts // self.interval * self.interval)
+        index = self._find(bucket) if self._count else None
+        if index is None:
+            if self._count and bucket < self._ts[(self._count - 1) % self.size]: return
+            slot = self._count % self.size
+            self._ts[slot] = bucket
+            self._ohlcv[slot * 5:slot * 5 + 5] = array('d', (price, price, price, price, qty))
+            self._count += 1
+        else:
+            base = index % self.size * 5
+            ohlcv = self._ohlcv
+            if price > ohlcv[base + 1]: ohlcv[base + 1] = price
+            if price < ohlcv[base + 2]: ohlcv[base + 2] = price
+            if index == self._count - 1:
+                ohlcv[base + 3] = price
+            ohlcv[base + 4] += qty
+        self.version += 1
+
+    def merge(self, candles: list[ds.Candle]) -> None:
+        """
+        Seed the buffer with candles from REST, older than anything streamed so far.
+        """
+        if self._count: return
+        for candle in candles[-self.size:]:
+            slot = self._count % self.size
+            self._ts[slot] = candle.timestamp
+            self._ohlcv[slot * 5:slot * 5 + 5] = array('d', (candle.open, candle.high, candle.low, candle.close, candle.volume))
+            self._count += 1
+        self.version += 1
+
+    def candles(self, since: int | None = None) -> list[ds.Candle]:
+        """
+        The buffered candles opened at or after `since` (all by default), oldest first.
+        """
+        first = self._count - len(self)
+        if since is not None:
+            # Candles are in time order: walk back from the newest one, a push only asks for the last few.
+            index = self._count
+            while index > first and self._ts[(index - 1) % self.size] >= since:
+                index -= 1
+            first = index
+        result = []
+        for index in range(first, self._count):
+            slot = index % self.size
+            o, h, l, c, v = self._ohlcv[slot * 5:slot * 5 + 5]
+            result.append(ds.Candle(timestamp=self._ts[slot], open=o, high=h, low=l, close=c, volume=v))
+        return result
+
+
+class TradeSource:
+    """
+    Public trade stream of one exchange.
+    """
+    ID = 'exchange'
+    URL = ''
+
+    def url(self, symbol: str) -> str:
+        return self.URL
+
+    def subscribe(self, symbol: str) -> dict[str, Any] | None:
+        return None
+
+    def trades(self, message: dict[str, Any]) -> list[tuple[float, float, float]]:
+        """
+        (timestamp in seconds, price, quantity) of every trade in a message
+        """
+        return []
+
+
+class BinanceTrades(TradeSource):
+    ID = 'binance'
+    URL = 'wss://stream.binance.com:9443/ws/{stream}@trade'
+
+    def url(self, symbol: str) -> str:
+        return self.URL.format(stream=symbol.lower())
+
+    def trades(self, message: dict[str, Any]) -> list[tuple[float, float, float]]:
+        if message.get('e') != 'trade': return []
+        return [(message['T'] / 1000, float(message['p']), float(message['q']))]
+
+
+class OkxTrades(TradeSource):
+    ID = 'okx'
+    URL = 'wss://ws.okx.com:8443/ws/v5/public'
+
+    def subscribe(self, symbol: str) -> dict[str, Any] | None:
+        return {'op': 'subscribe', 'args': [{'channel': 'trades', 'instId': symbol}]}
+
+    def trades(self, message: dict[str, Any]) -> list[tuple[float, float, float]]:
+        return [(int(trade['ts']) / 1000, float(trade['px']), float(trade['sz'])) for trade in message.get('data', ())]
+
+
+sources: dict[str, TradeSource] = {source.ID: source for source in (BinanceTrades(), OkxTrades())}
+
+
+class TradeFeed:
+    """
+    One upstream trade stream of a symbol, aggregated into a buffer per interval that is listened.
+    """
+    def __init__(self, source: TradeSource, symbol: str) -> None:
+        self.source = source
+        self.symbol = symbol
+        self.buffers: dict[int, CandleBuffer] = {}
+        self._refs: dict[int, int] = {}
+        self._task: asyncio.Task[None] | None = None
+
+    def acquire(self, interval: int) -> CandleBuffer:
+        if interval not in self.buffers:
+            self.buffers[interval] = CandleBuffer(interval)
+        self._refs[interval] = self._refs.get(interval, 0) + 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f'TradeFeed:{self.source.ID}:{self.symbol}')
+        return self.buffers[interval]
+
+    def release(self, interval: int) -> bool:
+        """
+        Drop one reference, and return if the feed is still needed
+        """
+        self._refs[interval] -= 1
+        if self._refs[interval] <= 0:
+            del self._refs[interval]
+            del self.buffers[interval]
+        if self._refs: return True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        return False
+
+    async def _run(self) -> None:
+        import websockets
+        while True:
+            try:
+                async with websockets.connect(self.source.url(self.symbol), open_timeout=10) as ws:
+                    subscribe = self.source.subscribe(self.symbol)
+                    if subscribe is not None:
+                        await ws.send(jsonlib.dumps(subscribe))
+                    logger.info(f'Streaming trades of {self.symbol} from {self.source.ID}')
+                    while True:
+                        try:
+                            raw = await asyncio.wait_for(ws.recv(), timeout=25)
+                        except asyncio.TimeoutError:
+                            # Quiet symbol: keep the connection alive (OKX drops it after 30s of silence).
+                            await ws.send('ping')
+                            continue
+                        if raw == 'pong': continue
+                        trades = self.source.trades(jsonlib.loads(raw))
+                        for buffer in self.buffers.values():
+                            for ts, price, qty in trades:
+                                buffer.add(ts, price, qty)
+                        metrics.STREAM_TRADES.inc(self.source.ID, value=len(trades))
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                metrics.STREAM_RECONNECTS.inc(self.source.ID)
+                logger.warning(f'Trade stream of {self.symbol} from {self.source.ID} failed: {e!r}')
+            await asyncio.sleep(STREAM_RECONNECT_DELAY)
+
+
+feeds: dict[tuple[str, str], TradeFeed] = {}
+
+
+class StreamFactory(ds.StreamCandleFactory):
+    """
+    Candles built in memory from the exchange trade stream: `1s`, `5s` and `15s`, and a `1m` candle
+    updated with every trade. Updates are pushed (`updates`) instead of polled.
+    """
+    # No trade in an interval, no candle.
+    SPARSE = True
+
+    def __init__(self, exchange: str, symbol: str, interval: str | None = None) -> None:
+        if exchange not in sources:
+            raise ValueError(f'Streaming not supported on {exchange}')
+        if interval not in STREAM_INTERVALS:
+            raise ValueError('Invalid Stream Interval')
+        self.http = cex_impl.HTTPCEX(exchange, symbol, '1m')
+        self._buffer: CandleBuffer | None = None
+        super().__init__(exchange, symbol, interval)
+
+    @property
+    def interval_seconds(self) -> int:
+        return STREAM_INTERVALS[self.interval]
+
+    @property
+    def max_limit(self) -> int | None:
+        return self.http.max_limit if self.interval_seconds == 60 else None
+
+    @property
+    def _feed_key(self) -> tuple[str, str]:
+        return self.exchange, self.http.cex.symbol_name(self.http.base, self.http.quote)
+
+    async def check(self) -> bool:
+        try:
+            seed = await self.http.fetch_latest()
+        except LookupError:
+            return False
+        if self._buffer is None:
+            key = self._feed_key
+            if key not in feeds:
+                feeds[key] = TradeFeed(sources[self.exchange], key[1])
+            self._buffer = feeds[key].acquire(self.interval_seconds)
+            if self.interval_seconds == 60:
+                self._buffer.merge(seed)
+        return True
+
+    def close(self) -> None:
+        if self._buffer is None: return
+        self._buffer = None
+        key = self._feed_key
+        if not feeds[key].release(self.interval_seconds):
+            del feeds[key]
+
+    async def updates(self) -> AsyncIterator[list[ds.Candle]]:
+        """
+        Yield the candles changed since the last update, at most every STREAM_PUSH_INTERVAL
+        """
+        version, since = -1, None
+        while self._buffer is not None:
+            buffer = self._buffer
+            if buffer.version != version:
+                version = buffer.version
+                candles = buffer.candles(since)
+                if candles:
+                    since = candles[-1].timestamp
+                    yield candles
+            await asyncio.sleep(STREAM_PUSH_INTERVAL)
+
+    async def fetch_latest(self) -> list[ds.Candle]:
+        return self._buffer.candles() if self._buffer is not None else []
+
+    async def fetch_newest(self) -> list[ds.Candle]:
+        return self._buffer.candles()[-2:] if self._buffer is not None else []
+
+    async def fetch_history(self, start: int | None = None, limit: int | None = None) -> list[ds.Candle]:
+        if self.interval_seconds == 60:
+            return await self.http.fetch_history(start, limit)
+        candles = await self.fetch_latest()
+        if start is not None:
+            candles = [candle for candle in candles if candle.timestamp >= start]
+        return candles[:limit] if limit else candles
+
+
+def init():
+    ds.register(StreamFactory)
@@ -1,3 +1,4 @@
+from utils import metrics
 import json as jsonlib
 import redis
 import os
@@ -12,18 +13,23 @@ class Cache:
             decode_responses=False,
         )
 
-    def get(self, key: str) -> str | None:
+    def _get(self, key: str) -> bytes | None:
         data: bytes | None = self._redis.get(key)
+        metrics.CACHE_REQUESTS.inc('redis', 'miss' if data is None else 'hit')
+        return data
+
+    def get(self, key: str) -> str | None:
+        data = self._get(key)
         if data is None: return
         return data.decode()
 
     def get_json(self, key: str, *, cls: type[jsonlib.JSONDecoder] | None = None) -> dict | None:
-        data: bytes | None = self._redis.get(key)
+        data = self._get(key)
         if data is None: return
         return jsonlib.loads(data, cls=cls)
 
     def get_int(self, key: str) -> int | None:
-        data: bytes | None = self._redis.get(key)
+        data = self._get(key)
         if data is None: return
         return int.from_bytes(data, 'big')
 
@@ -0,0 +1,173 @@
+from typing import Callable, Iterable
+from bisect import bisect_left
+import os
+
+
+ENABLED = os.getenv('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no', 'off', '')
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra: pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'): return '+Inf'
+    if value == int(value): return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def remove(self, *labels: str) -> None:
+        """
+        Drop a labelled series, e.g. when the tag it describes goes away.
+        """
+        self._values.pop(labels, None)
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0) -> None:
+        if not ENABLED: return
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in list(self._values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, *labels: str) -> None:
+        if not ENABLED: return
+        self._values[labels] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Compute the (unlabelled) value lazily at scrape time instead of on the hot path.
+        """
+        self._function = function
+
+    def samples(self) -> Iterable[str]:
+        if self._function is not None:
+            yield f'{self.name} {_number(float(self._function()))}'
+        for labels, value in list(self._values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not ENABLED: return
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for labels, series in list(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+UPSTREAM_LATENCY = histogram('candle_upstream_request_seconds', 'Latency of upstream kline requests.', ('source',))
+UPSTREAM_RESPONSES = counter('candle_upstream_responses_total', 'Upstream kline responses by HTTP status or error kind.', ('source', 'status'))
+UPSTREAM_RATE_LIMIT_WAIT = histogram('candle_upstream_rate_limit_wait_seconds', 'Time spent waiting on upstream rate limits.', ('source',))
+UPSTREAM_BREAKER_OPEN = gauge('candle_upstream_breaker_open', 'Whether the circuit breaker of an upstream is open (1) or closed (0).', ('source',))
+UPSTREAM_HEDGES = counter('candle_upstream_hedges_total', 'Failover decisions for wildcard tags by outcome (primary/hedge/rerouted).', ('source', 'outcome'))
+STREAM_TRADES = counter('candle_stream_trades_total', 'Trades received from upstream trade streams.', ('source',))
+STREAM_RECONNECTS = counter('candle_stream_reconnects_total', 'Upstream trade stream connections lost.', ('source',))
+BROADCAST_CYCLE = histogram('candle_broadcast_cycle_seconds', 'Duration of a full broadcast cycle.')
+BROADCAST_LAG = histogram('candle_broadcast_lag_seconds', 'Delay between the candle boundary and the start of a broadcast cycle.', buckets=(.01, .05, .1, .5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+DELIVERY_DELAY = histogram('candle_delivery_delay_seconds', 'Delay between the candle boundary and the update reaching the listeners of a tag.', ('source',), buckets=(.1, .5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0))
+POLLS_SKIPPED = counter('candle_polls_skipped_total', 'Polls skipped because the market of the tag is quiet.', ('source',))
+DEGRADED_TAGS = gauge('candle_degraded_tags', 'Polled tags refreshed less often than every period for lack of upstream budget.', ('source',))
+ADMISSIONS = counter('candle_admissions_total', 'New polled tags by admission result (admitted/queued/rejected).', ('source', 'result'))
+BACKFILLS = counter('candle_backfills_total', 'Gap backfills of live windows by result (filled/empty/error).', ('source', 'result'))
+FANOUT = histogram('candle_fanout_seconds', 'Time to fan a tag update out to its listeners.', ('source',))
+FANOUT_LAST = gauge('candle_fanout_last_seconds', 'Last fan-out duration of each tag.', ('tag',))
+ACTIVE_TAGS = gauge('candle_active_tags', 'Tags with at least one listener.')
+IDLE_TAGS = gauge('candle_idle_tags', 'Tags without listeners kept warm for a grace period.')
+IDLE_BYTES = gauge('candle_idle_bytes', 'Estimated bytes of candles cached by idle tags.')
+ACTIVE_LISTENERS = gauge('candle_active_listeners', 'Sum of listeners over all tags.')
+CONNECTED_SOCKETS = gauge('candle_connected_sockets', 'Connected WebSocket clients.')
+BYTES_SENT = counter('candle_ws_bytes_sent_total', 'Bytes of JSON frames sent to WebSocket clients.', ('type',))
+CACHE_REQUESTS = counter('candle_cache_requests_total', 'Cache lookups by cache and result (hit/miss).', ('cache', 'result'))
@@ -0,0 +1,101 @@
+from collections import Counter
+from types import FrameType
+from utils.logger import logger
+import json as jsonlib
+import threading
+import time
+import sys
+import os
+
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the event loop thread from a side thread and dumps
+    collapsed stacks (flamegraph.pl / speedscope compatible) after N broadcast cycles.
+    """
+    def __init__(self) -> None:
+        self.active = False
+        self._cycles = 0
+        self._target = 0
+        self._ident = 0
+        self._samples: Counter[str] = Counter()
+        self._started = 0.0
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self, cycles: int) -> None:
+        if self.active:
+            raise RuntimeError('Profiler already running')
+        if cycles <= 0:
+            raise ValueError('Invalid cycles: must be positive integer')
+        self.active = True
+        self._cycles = 0
+        self._target = cycles
+        self._ident = threading.get_ident()
+        self._samples = Counter()
+        self._started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+        logger.info(f'Profiling the next {cycles} broadcast cycles')
+
+    def cycle_done(self) -> None:
+        """
+        Called by the broadcast loop after each cycle while active.
+        """
+        self._cycles += 1
+        if self._cycles >= self._target:
+            self.stop()
+
+    def stop(self) -> str | None:
+        if not self.active: return None
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.active = False
+        return self.dump()
+
+    def status(self) -> dict[str, int | bool]:
+        return {'active': self.active, 'cycles': self._cycles, 'target': self._target, 'samples': sum(self._samples.values())}
+
+    @staticmethod
+    def _collapse(frame: FrameType | None) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def _run(self) -> None:
+        while not self._stop.wait(PROFILE_INTERVAL):
+            frame = sys._current_frames().get(self._ident)
+            if frame is not None:
+                self._samples[self._collapse(frame)] += 1
+
+    def dump(self) -> str | None:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = os.path.join(PROFILE_DIR, f'profile-{int(self._started)}')
+            with open(f'{name}.folded', 'w', encoding='utf-8') as f:
+                for stack, count in self._samples.most_common():
+                    f.write(f'{stack} {count}\n')
+            with open(f'{name}.json', 'w', encoding='utf-8') as f:
+                jsonlib.dump({
+                    'started': self._started,
+                    'duration': time.time() - self._started,
+                    'interval': PROFILE_INTERVAL,
+                    'cycles': self._cycles,
+                    'samples': sum(self._samples.values()),
+                }, f)
+            logger.info(f'Profile written to {name}.folded')
+            return f'{name}.folded'
+        except OSError as e:
+            logger.error(f'Failed to write profile: {e}')
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,38 @@
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second up to `capacity`.
+    """
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, tokens: float = 1.0) -> bool:
+        """
+        Take tokens if available, without waiting.
+        """
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """
+        Seconds until `tokens` would be available.
+        """
+        self._refill()
+        if self._tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self._tokens) / self.rate
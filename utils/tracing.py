@@ -0,0 +1,148 @@
+from typing import Any, Callable, TypeVar
+from contextlib import nullcontext
+from contextvars import ContextVar
+from utils.logger import logger
+import json as jsonlib
+import functools
+import random
+import time
+import os
+
+
+ENABLED = os.getenv('TRACE_ENABLED', '0').lower() in ('1', 'true', 'yes', 'on')
+SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', 10))
+SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+_NOOP = nullcontext()
+_current: ContextVar['Span | None'] = ContextVar('span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children', '_token')
+
+    def __init__(self, name: str, attrs: dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.end = 0.0
+        self.children: list[Span] = []
+        self._token = None
+
+    def __enter__(self) -> 'Span':
+        parent = _current.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _current.reset(self._token)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float) -> dict[str, Any]:
+        return {
+            'name': self.name,
+            'offset': round(self.start - origin, 6),
+            'duration': round(self.duration, 6),
+            **({'attrs': self.attrs} if self.attrs else {}),
+            **({'spans': [child.to_dict(origin) for child in self.children]} if self.children else {}),
+        }
+
+
+class Trace(Span):
+    """
+    Root span of a cycle; exported when it is slower than the threshold.
+    """
+    __slots__ = ()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        super().__exit__(exc_type, exc, tb)
+        if self.duration >= SLOW_SECONDS and random.random() < SAMPLE_RATE:
+            export(self)
+
+
+def export(trace: Trace) -> None:
+    record = {'ts': time.time(), **trace.to_dict(trace.start)}
+    if not TRACE_FILE:
+        return logger.warning(f'Slow {trace.name}: {jsonlib.dumps(record)}')
+    try:
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(jsonlib.dumps(record) + '\n')
+    except OSError as e:
+        logger.error(f'Failed to export trace to {TRACE_FILE}: {e}')
+
+
+def trace(name: str, **attrs: Any) -> Trace | nullcontext:
+    """
+    Start a root span.
+    """
+    if not ENABLED: return _NOOP
+    return Trace(name, attrs)
+
+
+def span(name: str, **attrs: Any) -> Span | nullcontext:
+    """
+    Start a child span of the current trace, a no-op outside of one.
+    """
+    if _current.get() is None: return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Wrap a coroutine function in a span; the function is returned untouched when tracing is disabled.
+    """
+    def decorator(func: F) -> F:
+        if not ENABLED: return func
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper  # type: ignore
+    return decorator
+
+
+_HTTP_PHASES = {
+    'connection.connect_tcp': 'connect',
+    'connection.start_tls': 'tls',
+    'http11.send_request_headers': 'send',
+    'http2.send_request_headers': 'send',
+    'http11.receive_response_headers': 'upstream',
+    'http2.receive_response_headers': 'upstream',
+    'http11.receive_response_body': 'download',
+    'http2.receive_response_body': 'download',
+}
+
+
+async def _httpx_trace(event_name: str, info: dict[str, Any]) -> None:
+    phase, _, state = event_name.rpartition('.')
+    name = _HTTP_PHASES.get(phase)
+    if name is None: return
+    if state == 'started':
+        current = _current.get()
+        if current is None: return
+        child = Span(name, {})
+        child.start = time.perf_counter()
+        current.children.append(child)
+    elif state in ('complete', 'failed'):
+        current = _current.get()
+        if current is None: return
+        for child in reversed(current.children):
+            if child.name == name and not child.end:
+                child.end = time.perf_counter()
+                if state == 'failed': child.attrs['error'] = type(info.get('exception')).__name__
+                break
+
+
+# Passed to httpx requests as `extensions=` so DNS/TCP, TLS, TTFB and download show up as spans.
+HTTPX_EXTENSIONS: dict[str, Any] = {'trace': _httpx_trace} if ENABLED else {}
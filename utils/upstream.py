@@ -0,0 +1,131 @@
+from collections import defaultdict
+import threading
+import httpx
+import json
+import os
+
+
+# Redirect every upstream request to http(s)://<override>/<original host><original path>,
+# used to point the exchanges and GeckoTerminal at a local fake server.
+UPSTREAM_OVERRIDE = os.getenv('UPSTREAM_OVERRIDE', '')
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 5))
+# Append every upstream exchange to <dir>/<host>.jsonl, or answer only from such recordings.
+HTTP_RECORD = os.getenv('HTTP_RECORD', '')
+HTTP_REPLAY = os.getenv('HTTP_REPLAY', '')
+# Query parameters carrying timestamps, ignored when no recording matches a request exactly.
+VOLATILE_PARAMS = {'startTime', 'endTime', 'after', 'before', 'startAt', 'endAt', 'from', 'to', 'before_timestamp'}
+KEPT_HEADERS = {'content-type', 'retry-after'}
+
+
+class RedirectTransport(httpx.AsyncBaseTransport):
+    def __init__(self, target: str, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self._target = httpx.URL(target)
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        request.url = self._target.copy_with(path=f'/{url.host}{url.path}', query=url.query or None)
+        request.headers['Host'] = request.url.netloc.decode('ascii')
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def request_keys(method: str, host: str, path: str, query: list[tuple[str, str]]) -> tuple[str, str]:
+    """
+    The exact key of a request and its key without timestamp parameters
+    """
+    exact = json.dumps([method, host, path, sorted(query)])
+    shape = json.dumps([method, host, path, sorted((k, '' if k in VOLATILE_PARAMS else v) for k, v in query)])
+    return exact, shape
+
+
+class RecordTransport(httpx.AsyncBaseTransport):
+    """
+    Pass requests through and append each exchange to a fixture file per host.
+    """
+    def __init__(self, directory: str, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self._directory = directory
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        # Taken before the inner transport, which may rewrite the URL (UPSTREAM_OVERRIDE).
+        record = {'method': request.method, 'host': url.host, 'path': url.path, 'query': list(url.params.multi_items())}
+        response = await self._transport.handle_async_request(request)
+        raw = b''.join([chunk async for chunk in response.stream])
+        await response.aclose()
+        response = httpx.Response(response.status_code, headers=response.headers, content=raw, request=request)
+        record['status'] = response.status_code
+        record['headers'] = {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS}
+        record['body'] = httpx.Response(response.status_code, headers=response.headers, content=raw).text
+        with self._lock, open(os.path.join(self._directory, f'{url.host}.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answer from recordings without any network: by exact request first, then ignoring timestamp
+    parameters. Repeated requests walk through the recorded responses in order and stay on the last.
+    """
+    def __init__(self, directory: str) -> None:
+        self._responses: dict[str, list[dict]] = defaultdict(list)
+        self._served: dict[str, int] = defaultdict(int)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.jsonl'): continue
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip(): continue
+                    record = json.loads(line)
+                    for key in request_keys(record['method'], record['host'], record['path'], [tuple(pair) for pair in record['query']]):
+                        self._responses[key].append(record)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = request.url
+        for key in request_keys(request.method, url.host, url.path, list(url.params.multi_items())):
+            if key in self._responses:
+                records = self._responses[key]
+                record = records[min(self._served[key], len(records) - 1)]
+                self._served[key] += 1
+                return httpx.Response(record['status'], headers=record['headers'], text=record['body'], request=request)
+        raise httpx.ConnectError(f'No recording for {request.method} {url}', request=request)
+
+
+_client: httpx.AsyncClient | None = None
+
+
+def transport() -> httpx.AsyncBaseTransport | None:
+    if HTTP_REPLAY:
+        return ReplayTransport(HTTP_REPLAY)
+    inner = RedirectTransport(UPSTREAM_OVERRIDE) if UPSTREAM_OVERRIDE else None
+    if HTTP_RECORD:
+        return RecordTransport(HTTP_RECORD, inner)
+    return inner
+
+
+def client() -> httpx.AsyncClient:
+    """
+    The HTTP client shared by all upstream adapters, so connections (and TLS sessions) are reused.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            transport=transport(),
+            timeout=UPSTREAM_TIMEOUT,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
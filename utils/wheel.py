@@ -0,0 +1,64 @@
+from typing import Generic, Hashable, TypeVar
+import math
+
+
+K = TypeVar('K', bound=Hashable)
+
+
+class TimingWheel(Generic[K]):
+    """
+    Hashed timing wheel for deadlines no further than `horizon` seconds ahead.
+
+    `touch` and `discard` are O(1); `expire` only visits the slots that elapsed since the last call,
+    so idle keys cost nothing between events and expire within `resolution` of their deadline.
+    """
+    def __init__(self, horizon: float, resolution: float = 1.0) -> None:
+        self._resolution = resolution
+        self._slots: list[dict[K, float]] = [{} for _ in range(math.ceil(horizon / resolution) + 2)]
+        self._where: dict[K, int] = {}
+        self._tick: int | None = None
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._where
+
+    def _slot(self, deadline: float) -> int:
+        return int(deadline // self._resolution) % len(self._slots)
+
+    def touch(self, key: K, deadline: float) -> None:
+        """
+        Set (or move) the deadline of a key.
+        """
+        self.discard(key)
+        index = self._slot(deadline)
+        self._slots[index][key] = deadline
+        self._where[key] = index
+
+    def discard(self, key: K) -> None:
+        index = self._where.pop(key, None)
+        if index is not None:
+            self._slots[index].pop(key, None)
+
+    def expire(self, now: float) -> list[K]:
+        """
+        Pop and return every key whose deadline is at or before `now`.
+        """
+        tick = int(now // self._resolution)
+        if self._tick is None:
+            self._tick = tick - len(self._slots) + 1
+        # Never walk more than one revolution, even after a long stall.
+        start = max(self._tick, tick - len(self._slots) + 1)
+        expired: list[K] = []
+        for t in range(start, tick + 1):
+            slot = self._slots[t % len(self._slots)]
+            if not slot: continue
+            for key, deadline in list(slot.items()):
+                if deadline <= now:
+                    del slot[key]
+                    del self._where[key]
+                    expired.append(key)
+        # The current slot may still hold deadlines later within this tick; revisit it next time.
+        self._tick = tick
+        return expired